@@ -1,6 +1,10 @@
+import argparse
 from automation import *
 from operation import *
 from logger import *
+from mongo_client import close_clients
+from metrics import MetricsExporter
+from setting import get_variables, register_reload_signal
 
 # # retrun all taks status
 # def get_automation_progress(self):
@@ -18,8 +22,20 @@ from logger import *
         
 if __name__ == "__main__":
 
+    # Command line options
+    parser = argparse.ArgumentParser(description="MongoDB data archiving job")
+    parser.add_argument("--engine", choices=["SYNC", "ASYNC"], type=str.upper, help="archive engine, ARCHIVE_ENGINE is used when it is not given")
+    parser.add_argument("--dry-run", action="store_true", help="estimate documents, bytes and read time per collection and day, nothing is written or deleted")
+    parser.add_argument("--report", type=str, help="JSON file for the dry run report")
+    args = parser.parse_args()
+
     try:
         
+        # Load and validate the settings once, SIGHUP reloads them
+        if get_variables() is None:
+            raise SystemExit("Invalid settings in cred/.env!")
+        register_reload_signal()
+
         # Get PID
         pid_file = get_variables().PID_FILE
         log_file = get_variables().LOG_FILE
@@ -33,9 +49,30 @@ if __name__ == "__main__":
         log_directory = get_variables().LOG_DIRECTORY
         operation_log=tracker.generate_log_file(log_directory=log_directory, operation_id=operation_id)
 
-        jobs = Automation(operation_log, operation_id)
         log = Logger(logfile=operation_log)
 
+        if args.dry_run:
+            # Only the dry run needs the estimator
+            from estimator import ArchiveEstimator
+
+            print("**************************Dry run is started *********************************")
+            log.log_info("**************************Dry run is started *********************************")
+
+            report = ArchiveEstimator(operation_log, operation_id).run(report_path=args.report)
+
+            print("**************************Dry run is ended ***********************************")
+            log.log_info("**************************Dry run is ended ***********************************")
+
+            close_clients()
+            del tracker
+            raise SystemExit(0 if report is not None else 1)
+
+        jobs = Automation(operation_log, operation_id, engine=args.engine)
+
+        # Metrics are exported while the jobs run
+        metrics_exporter = MetricsExporter()
+        metrics_exporter.start()
+
         print("**************************Jobs are started **********************************")
         print(f"pid : {operation_id}")
         print("++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++")
@@ -55,6 +92,11 @@ if __name__ == "__main__":
         # Upload Log, if success it is okay
         #log.upload_log()
 
+        metrics_exporter.stop()
+
+        # Close the shared MongoDB connection pools
+        close_clients()
+
         del tracker
 
     except Exception as e:
@@ -0,0 +1,103 @@
+import asyncio
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from bson_reader import get_document_field
+from logger import *
+
+# Server error code of a duplicate key
+DUPLICATE_KEY_ERROR = 11000
+
+# Destination of the archived documents of one collection and day
+#   write(batch)  stores a batch, returns the documents that are safe to delete from the source, the new ones and the ones already present
+#   flush()       pushes what the sink still buffers
+#   commit()      the day is complete, called once after its last batch
+class ArchiveSink(Logger):
+    # The documents are kept by the sink, so they may be deleted from the source
+    is_durable = True
+
+    def __init__(self, logfile, collection_name, day):
+        super().__init__(logfile)
+        self.collection_name = collection_name
+        self.day = day
+
+    def write(self, batch):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        self.flush()
+        return None
+
+    # Used by the async engine, a sink without an async client writes on a worker thread
+    async def write_async(self, batch):
+        return await asyncio.get_running_loop().run_in_executor(None, self.write, batch)
+
+# Duplicate key on _id, the document is already in the archive from an earlier attempt
+# A duplicate on another unique index of the archive means the document was not stored
+def is_duplicate_id_error(write_error):
+    if (write_error.get("code")!=DUPLICATE_KEY_ERROR):
+        return False
+
+    key_pattern = write_error.get("keyPattern")
+    if (key_pattern is not None):
+        return dict(key_pattern)=={"_id": 1}
+
+    # Servers before 4.4 only name the index in the message
+    return " index: _id_ " in write_error.get("errmsg", "")
+
+# Documents of a batch confirmed in the archive after a BulkWriteError, with the new and already present counts
+def get_bulk_write_outcome(sink, batch, error, write_mode):
+    # With ordered=False every document is attempted, only the reported indexes failed
+    write_errors = error.details.get("writeErrors", [])
+
+    failed_indexes = set(write_error["index"] for write_error in write_errors if not is_duplicate_id_error(write_error))
+    duplicates = len(write_errors) - len(failed_indexes)
+    confirmed = [document for index, document in enumerate(batch) if index not in failed_indexes]
+    inserted = error.details.get("nUpserted", 0) if write_mode=="UPSERT" else error.details.get("nInserted", 0)
+
+    if failed_indexes:
+        print(f"Error: {len(failed_indexes)} of {len(batch)} records are not archived.")
+        sink.log_error(f"Exception: {len(failed_indexes)} of {len(batch)} records are not archived. {str(error)}")
+
+    return confirmed, inserted, duplicates + error.details.get("nMatched", 0)
+
+# Collection of the archive MongoDB
+class MongoArchiveSink(ArchiveSink):
+    def __init__(self, logfile, collection, day, write_mode):
+        super().__init__(logfile, collection.name, day)
+        self.collection = collection
+        self.write_mode = write_mode
+
+    def get_requests(self, batch):
+        # Replacing by _id makes a retried batch a no-op for the documents already archived
+        return [ReplaceOne({"_id": get_document_field(document, "_id")}, document, upsert=True) for document in batch]
+
+    def write(self, batch):
+        try:
+            if (self.write_mode=="UPSERT"):
+                result = self.collection.bulk_write(self.get_requests(batch), ordered=False)
+                return batch, result.upserted_count, result.matched_count
+
+            # inserted_ids leaves out raw BSON documents, without an error every document is inserted
+            self.collection.insert_many(batch, ordered=False)
+            return batch, len(batch), 0
+
+        except BulkWriteError as e:
+            return get_bulk_write_outcome(sink=self, batch=batch, error=e, write_mode=self.write_mode)
+
+# Discards every batch, the source is read but nothing is deleted, used to measure the read path
+class NullArchiveSink(ArchiveSink):
+    is_durable = False
+
+    def __init__(self, logfile, collection_name, day):
+        super().__init__(logfile, collection_name, day)
+        self.documents = 0
+
+    def write(self, batch):
+        self.documents = self.documents + len(batch)
+        return batch, len(batch), 0
+
+    def commit(self):
+        return {"collection": self.collection_name, "day": self.day.strftime("%Y-%m-%d"), "documents": self.documents}
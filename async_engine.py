@@ -0,0 +1,359 @@
+import asyncio
+import threading
+from datetime import timedelta
+from timeit import default_timer as timer
+from datetime_truncate import truncate
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+from archive_sink import MongoArchiveSink, get_bulk_write_outcome
+from db import DatabaseExecutor
+from mongo_client import get_client_options
+import metrics
+
+# Archive collection through a Motor client, the writes stay on the event loop
+# write() goes through sync_sink, the same collection on the shared PyMongo client
+class AsyncMongoArchiveSink(MongoArchiveSink):
+    def __init__(self, logfile, collection, day, write_mode, sync_sink):
+        super().__init__(logfile, collection, day, write_mode)
+        self.sync_sink = sync_sink
+
+    def write(self, batch):
+        return self.sync_sink.write(batch)
+
+    async def write_async(self, batch):
+        try:
+            if (self.write_mode=="UPSERT"):
+                result = await self.collection.bulk_write(self.get_requests(batch), ordered=False)
+                return batch, result.upserted_count, result.matched_count
+
+            # inserted_ids leaves out raw BSON documents, without an error every document is inserted
+            await self.collection.insert_many(batch, ordered=False)
+            return batch, len(batch), 0
+
+        except BulkWriteError as e:
+            return get_bulk_write_outcome(sink=self, batch=batch, error=e, write_mode=self.write_mode)
+
+# Pipelined engine, reads from the source, writes to the archive and deletes from the source at the same time
+class AsyncDatabaseExecutor(DatabaseExecutor):
+    def __init__(self, logfile, operation_id=None):
+        super().__init__(logfile, operation_id)
+        # Event loop of the executor on its own thread, the shards of every collection run on it
+        self.loop = None
+        self.loop_thread = None
+        self.loop_lock = threading.Lock()
+        # Motor clients of the loop, created once and reused by every shard
+        self.source_client = None
+        self.archive_client = None
+
+    # Event loop of the executor, started on first use
+    def get_event_loop(self):
+        with self.loop_lock:
+            if (self.loop is None):
+                self.loop = asyncio.new_event_loop()
+                self.loop_thread = threading.Thread(target=self.loop.run_forever, name="archive-event-loop", daemon=True)
+                self.loop_thread.start()
+
+            return self.loop
+
+    # Motor clients belong to the event loop that created them, called on the executor loop only
+    def get_async_clients(self):
+        if (self.source_client is None):
+            self.source_client = AsyncIOMotorClient(f"mongodb://{self.host}:{self.port}/", username=self.username, password=self.password, **get_client_options())
+            if (self.is_archive_enabled=="YES" and self.archive_target=="MONGODB"):
+                self.archive_client = AsyncIOMotorClient(f"mongodb://{self.host_archive}:{self.port_archive}/", username=self.username_archive, password=self.password_archive, **get_client_options())
+
+        return self.source_client, self.archive_client
+
+    def close_async_clients(self):
+        if (self.source_client is not None):
+            self.source_client.close()
+        if (self.archive_client is not None):
+            self.archive_client.close()
+        self.source_client = None
+        self.archive_client = None
+
+    # Close the Motor clients and stop the event loop, called once the executor is done
+    def close(self):
+        with self.loop_lock:
+            if (self.loop is None):
+                return
+
+            # Callbacks run in order, the clients are closed before the loop stops
+            self.loop.call_soon_threadsafe(self.close_async_clients)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+            self.loop = None
+            self.loop_thread = None
+
+    # Archive and delete one time shard through the asyncio pipeline
+    def archive_time_range(self, collection, ts_field_name, id_field_name, shard, total_docs, batch_controller=None, checkpoint_data=None):
+        try:
+            # Shard threads hand their shard to the executor loop and wait for it
+            future = asyncio.run_coroutine_threadsafe(self.archive_time_range_async(collection_name=collection.name, ts_field_name=ts_field_name, id_field_name=id_field_name,
+                                                                                    shard=shard, total_docs=total_docs, batch_controller=batch_controller, checkpoint_data=checkpoint_data),
+                                                      self.get_event_loop())
+            return future.result()
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    async def archive_time_range_async(self, collection_name, ts_field_name, id_field_name, shard, total_docs, batch_controller, checkpoint_data):
+        print(f"Shard {shard.shard_no} started (async): {shard.start_date} - {shard.end_date}")
+        self.log_info(f"Shard {shard.shard_no} started (async): {shard.start_date} - {shard.end_date}")
+
+        is_archive_enabled = (self.is_archive_enabled=="YES")
+
+        source_client, archive_client = self.get_async_clients()
+
+        source_collection = source_client[self.database][collection_name]
+
+        state = {
+            "collection_name": collection_name,
+            "source_collection": source_collection,
+            "read_collection": self.get_raw_collection(source_collection) if is_archive_enabled and (self.is_raw_bson_enabled=="YES" or self.archive_target!="MONGODB") else source_collection,
+            "archive_client": archive_client,
+            "ts_field_name": ts_field_name,
+            "id_field_name": id_field_name,
+            "shard": shard,
+            "total_docs": total_docs,
+            "batch_controller": batch_controller,
+            "checkpoint_data": checkpoint_data,
+            "is_archive_enabled": is_archive_enabled,
+            "total_deleted": 0,
+            "total_failed": 0,
+            "last_id": None,
+            # Sinks of the days read but not committed yet
+            "open_sinks": []
+        }
+
+        # Bounded queues, a slow stage stops the stages in front of it
+        write_queue = asyncio.Queue(maxsize=self.pipeline_queue_depth)
+        delete_queue = asyncio.Queue(maxsize=self.pipeline_queue_depth)
+
+        tasks = [asyncio.ensure_future(self.read_stage(state, write_queue)),
+                 asyncio.ensure_future(self.write_stage(state, write_queue, delete_queue)),
+                 asyncio.ensure_future(self.delete_stage(state, delete_queue))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            # A failed or cancelled shard still commits the days in flight, their deleted documents must reach the manifest
+            for archive_sink in list(state["open_sinks"]):
+                try:
+                    # Off the loop, the other shards keep running meanwhile
+                    await asyncio.get_running_loop().run_in_executor(None, self.commit_archive_sink, archive_sink)
+                except Exception as e:
+                    print(f"Error: {e}")
+                    self.log_error(f"Exception: {str(e)}")
+            state["open_sinks"] = []
+
+            # Items left behind by a failed shard are no longer waiting
+            metrics.queue_depth.labels(collection_name, "write").dec(write_queue.qsize())
+            metrics.queue_depth.labels(collection_name, "delete").dec(delete_queue.qsize())
+
+        if state["total_failed"]>0:
+            print(f"Shard {shard.shard_no}: {state['total_failed']} records could not be archived and are kept in the source.")
+            self.log_error(f"Shard {shard.shard_no}: {state['total_failed']} records could not be archived and are kept in the source.")
+            return None
+
+        if state.get("stopped_at") is not None:
+            self.is_stopped_by_deadline = True
+            print(f"Shard {shard.shard_no} stopped at {state['stopped_at']}, the time budget is used up: {state['total_deleted']} documents deleted")
+            self.log_warning(f"Shard {shard.shard_no} stopped at {state['stopped_at']}, the time budget is used up: {state['total_deleted']} documents deleted")
+            return state["total_deleted"]
+
+        print(f"Shard {shard.shard_no} completed: {state['total_deleted']} documents deleted")
+        self.log_info(f"Shard {shard.shard_no} completed: {state['total_deleted']} documents deleted")
+
+        return state["total_deleted"]
+
+    # Read the shard day by day and queue the batches, a day marker follows the last batch of each day
+    async def read_stage(self, state, write_queue):
+        shard = state["shard"]
+        batch_controller = state["batch_controller"]
+        id_field_name = state["id_field_name"]
+        ts_field_name = state["ts_field_name"]
+
+        # Without archive only the ids are needed for the delete
+        projection = None if state["is_archive_enabled"] else {id_field_name: 1}
+
+        read_seconds = metrics.batch_read_seconds.labels(state["collection_name"])
+        in_flight = metrics.batches_in_flight.labels(state["collection_name"])
+        queue_depth = metrics.queue_depth.labels(state["collection_name"], "write")
+
+        try:
+            from_date = shard.start_date
+            # The read stage stops first when the time budget is used up, the days already queued are finished
+            while (from_date<shard.end_date and state["total_failed"]==0 and not self.is_deadline_passed()):
+                start_date = from_date
+                end_date = min(truncate(start_date, 'day') + timedelta(days=1), shard.end_date)
+                filter_condition = {ts_field_name: {"$gte": start_date, "$lt": end_date}}
+
+                # Sink of the day, the write stage commits it after the day marker
+                archive_sink = self.create_async_archive_sink(state=state, day=start_date)
+                if archive_sink is not None:
+                    state["open_sinks"].append(archive_sink)
+
+                batch_size = batch_controller.get_batch_size() if batch_controller else self.batch_size
+                cursor = state["read_collection"].find(filter_condition, projection=projection).batch_size(batch_size)
+
+                # Size of the batch read when it starts, the controller lock is not taken for every document
+                batch = []
+                limit = batch_size
+                read_start = timer()
+                async for document in cursor:
+                    batch.append(document)
+                    if len(batch) >= limit:
+                        read_seconds.observe(timer() - read_start)
+                        in_flight.inc()
+                        await write_queue.put(("batch", filter_condition, batch, archive_sink))
+                        queue_depth.inc()
+                        batch = []
+                        limit = batch_controller.get_batch_size() if batch_controller else self.batch_size
+                        read_start = timer()
+
+                if batch:
+                    read_seconds.observe(timer() - read_start)
+                    in_flight.inc()
+                    await write_queue.put(("batch", filter_condition, batch, archive_sink))
+                    queue_depth.inc()
+
+                await write_queue.put(("day", start_date, end_date, archive_sink))
+                queue_depth.inc()
+
+                from_date = end_date
+
+            if (from_date<shard.end_date and state["total_failed"]==0):
+                state["stopped_at"] = from_date
+
+            await write_queue.put(None)
+            queue_depth.inc()
+        except BaseException:
+            self.put_end_marker_nowait(write_queue, queue_depth)
+            raise
+
+    # Write the batches into the archive and pass the confirmed ids on
+    async def write_stage(self, state, write_queue, delete_queue):
+        id_field_name = state["id_field_name"]
+        collection_name = state["collection_name"]
+        write_seconds_metric = metrics.batch_write_seconds.labels(collection_name)
+        write_queue_depth = metrics.queue_depth.labels(collection_name, "write")
+        delete_queue_depth = metrics.queue_depth.labels(collection_name, "delete")
+
+        try:
+            while True:
+                item = await write_queue.get()
+                write_queue_depth.dec()
+                if item is None:
+                    break
+
+                if item[0]!="batch":
+                    # Every batch of the day is written, the sink may finish its files
+                    await asyncio.get_running_loop().run_in_executor(None, self.commit_archive_sink, item[3])
+                    if item[3] in state["open_sinks"]:
+                        state["open_sinks"].remove(item[3])
+                    await delete_queue.put(item)
+                    delete_queue_depth.inc()
+                    continue
+
+                item_type, filter_condition, batch, archive_sink = item
+                batch_start = timer()
+
+                confirmed = batch
+                # Without archive the documents hold only their ids, their bytes are not measured
+                confirmed_bytes = 0
+                if archive_sink is not None:
+                    confirmed, records_inserted, records_duplicated = await archive_sink.write_async(batch)
+                    write_seconds_metric.observe(timer() - batch_start)
+                    state["total_failed"] = state["total_failed"] + len(batch) - len(confirmed)
+
+                    # A sink that keeps nothing leaves the source untouched
+                    if not archive_sink.is_durable:
+                        confirmed = []
+                    else:
+                        # Measured once per batch, the delete stage reuses it
+                        confirmed_bytes = metrics.get_batch_bytes(confirmed)
+                        metrics.documents_copied.labels(collection_name).inc(len(confirmed))
+                        metrics.bytes_copied.labels(collection_name).inc(confirmed_bytes)
+
+                ids = [self.get_document_id(document, id_field_name) for document in confirmed]
+                await delete_queue.put(("batch", filter_condition, ids, len(batch), timer() - batch_start, confirmed_bytes))
+                delete_queue_depth.inc()
+
+            await delete_queue.put(None)
+            delete_queue_depth.inc()
+        except BaseException:
+            self.put_end_marker_nowait(delete_queue, delete_queue_depth)
+            raise
+
+    # End marker of a failed or cancelled stage, the shard cancels the consumer as well
+    # Waiting on a full queue that nobody drains any more would hang the shard, the marker is dropped instead
+    def put_end_marker_nowait(self, queue, queue_depth):
+        try:
+            queue.put_nowait(None)
+            queue_depth.inc()
+        except asyncio.QueueFull:
+            pass
+
+    # Delete the confirmed ids and checkpoint each finished day
+    async def delete_stage(self, state, delete_queue):
+        shard = state["shard"]
+        batch_controller = state["batch_controller"]
+        checkpoint_data = state["checkpoint_data"]
+        collection_name = state["collection_name"]
+        in_flight = metrics.batches_in_flight.labels(collection_name)
+        queue_depth = metrics.queue_depth.labels(collection_name, "delete")
+        day_deleted = 0
+
+        while True:
+            item = await delete_queue.get()
+            queue_depth.dec()
+            if item is None:
+                break
+
+            if item[0]=="day":
+                item_type, start_date, end_date, archive_sink = item
+                if day_deleted>0:
+                    print(f"Deleted [{start_date}]: {state['total_deleted']} documents in shard {shard.shard_no}, {state['total_docs']} expired in total")
+                    self.log_info(f"Deleted [{start_date}]: {state['total_deleted']} documents in shard {shard.shard_no}, {state['total_docs']} expired in total")
+                day_deleted = 0
+
+                # A day with failed writes or written to a sink that keeps nothing is not finished, a new run starts from it again
+                if (checkpoint_data is not None and state["total_failed"]==0 and self.is_sink_durable(archive_sink)):
+                    checkpoint_data.update_progress(collection_name=state["collection_name"], shard_no=shard.shard_no, last_archived_date=end_date, last_id=state["last_id"],
+                                                    shard_status="Completed" if end_date>=shard.end_date else "In Progress")
+                continue
+
+            item_type, filter_condition, ids, documents, write_seconds, confirmed_bytes = item
+            delete_start = timer()
+
+            if ids:
+                result = await state["source_collection"].delete_many({"$and": [filter_condition, {state["id_field_name"]: {"$in": ids}}]})
+                metrics.batch_delete_seconds.labels(collection_name).observe(timer() - delete_start)
+                metrics.documents_deleted.labels(collection_name).inc(result.deleted_count)
+                metrics.bytes_deleted.labels(collection_name).inc(int(confirmed_bytes * result.deleted_count / len(ids)))
+                state["total_deleted"] = state["total_deleted"] + result.deleted_count
+                day_deleted = day_deleted + result.deleted_count
+                state["last_id"] = ids[-1]
+
+            if batch_controller:
+                # The controller may wait for the secondaries, keep the event loop free meanwhile
+                await asyncio.get_running_loop().run_in_executor(None, batch_controller.record, documents, write_seconds + timer() - delete_start)
+
+            in_flight.dec()
+
+    # Sink of one day, the archive MongoDB is written through the Motor client of the shard
+    def create_async_archive_sink(self, state, day):
+        if (state["archive_client"] is not None):
+            collection = state["archive_client"][self.database_archive][state["collection_name"]]
+            return AsyncMongoArchiveSink(logfile=self.log_file, collection=collection, day=day, write_mode=self.archive_write_mode,
+                                         sync_sink=self.create_archive_sink(collection_name=state["collection_name"], day=day))
+
+        return self.create_archive_sink(collection_name=state["collection_name"], day=day)
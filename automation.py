@@ -5,19 +5,190 @@ from setting import get_variables
 from notification import notification
 from operationdb import operation_db, OperationMaster
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from timeit import default_timer as timer
 from datetime import datetime
 from task import *
+from compaction import CompactionScheduler
+from forecast import RuntimeForecaster
+from scheduler import TaskScheduler
 
 class Automation(Logger):
-    def __init__(self, logfile, operation_id):
+    def __init__(self, logfile, operation_id, engine=None):
         super().__init__(logfile)
         self.operation_log=logfile
         self.operation_id = operation_id
 
+        # SYNC or ASYNC archive engine
+        self.engine = (engine or get_variables().ARCHIVE_ENGINE).upper()
+
         # Create a list to store Task objects
         self.task_list = []
 
+        # Compactions run in the background after the deletes
+        self.compaction_scheduler = None
+
+        # Order of the collections and their deadlines
+        self.task_scheduler = None
+
+        # Progress shared by the collection workers
+        self.progress_lock = threading.Lock()
+        self.total_passed_tasks = 0
+        self.total_collection = 0
+        self.operation_start = timer()
+
+    # Executor of the selected archive engine, shared_db hands over its planner cache and retention cutoff
+    def create_executor(self, shared_db=None):
+        if (self.engine=="ASYNC"):
+            # Motor is only needed by the async engine
+            from async_engine import AsyncDatabaseExecutor
+            executor = AsyncDatabaseExecutor(self.operation_log, self.operation_id)
+        else:
+            executor = DatabaseExecutor(self.operation_log, self.operation_id)
+
+        if (shared_db is not None):
+            # Same cutoff as the forecast, so the range statistics it read are found in the cache
+            executor.planner = shared_db.planner
+            executor.retention_cutoff = shared_db.get_retention_cutoff()
+
+        return executor
+
+    # Task of a parallel run on an executor of its own, closed when the task ends
+    def run_worker_task(self, shared_db, operation_db_instance, task):
+        worker_db = self.create_executor(shared_db=shared_db)
+        try:
+            return self.run_task(db=worker_db, operation_db_instance=operation_db_instance, task=task)
+        finally:
+            worker_db.close()
+
+    # Archive one collection and report its progress into the operation database
+    def run_task(self, db, operation_db_instance, task):
+        try:
+            # Timer
+            start = timer()
+
+            print("********************************************************************")
+            self.log_info("********************************************************************")
+            print(f"Archiving started: {task.task_name}")
+            print("===================================================")
+            self.log_info(f"Archiving started: {task.task_name}")
+            self.log_info("===================================================")
+
+            # Nothing starts after the maintenance window
+            if (self.task_scheduler is not None and self.task_scheduler.is_window_closed()):
+                task.task_status = "Skipped"
+                task.remarks = "The maintenance window ended before the collection started."
+                self.log_warning(f"{task.task_name}: {task.remarks}")
+                print(f"{task.task_name}: {task.remarks}")
+                operation_db_instance.update_operation_detail(OperationDetail=task)
+                return True
+
+            # The collection stops between days at the end of its time budget or of the window
+            db.deadline = self.task_scheduler.get_deadline(task) if self.task_scheduler is not None else None
+
+            # Update Task Status
+            task.task_start_datetime=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            task.task_status = "In Progress"
+
+            # Update Task into database
+            upd_task_status = operation_db_instance.update_operation_detail(OperationDetail=task)
+
+            # Storage before the deletes, compared after them to estimate the freed space
+            storage_before = self.compaction_scheduler.read_storage_statistics(collection_name=task.task_name)
+
+            #total_deleted = db.delete_old_data(collection_name=collection.collection_name ,ts_field_name=collection.ts_field_name, id_field_name=collection.id_field_name)
+            total_deleted = db.delete_old_data_by_date(collection_name=task.task_name ,ts_field_name=task.ts_field_name, id_field_name=task.id_field_name)
+
+            # Update task status
+            if (total_deleted<0):
+                task.task_status="Failed"
+                task.remarks=f"Unable to archive {task.task_name} collection."
+                self.log_error(f"{task.remarks}")
+                print(f"{task.remarks}")
+                #raise Exception(f"{task.remarks}")
+            elif (db.is_stopped_by_deadline):
+                # Not a failure, but not a complete run either, the forecast leaves it out of the history
+                task.task_status="Partial"
+                task.remarks = "The time budget is used up, the remaining days resume on the next run."
+                self.log_warning(f"{task.task_name}: {task.remarks}")
+                print(f"{task.task_name}: {task.remarks}")
+            else:
+                task.task_status="Completed"
+
+            # Batch size used for the collection
+            task.batch_size = db.last_batch_size
+
+            # Volume and seconds per phase of the collection
+            if (db.last_task_metrics is not None):
+                task_metrics = db.last_task_metrics.finish()
+                task.backlog_docs = task_metrics.backlog_docs
+                task.docs_copied = task_metrics.docs_copied
+                task.docs_deleted = task_metrics.docs_deleted
+                task.bytes_copied = task_metrics.bytes_copied
+                task.bytes_deleted = task_metrics.bytes_deleted
+                task.plan_seconds = round(task_metrics.plan_seconds, 3) if task_metrics.plan_seconds is not None else None
+                task.read_seconds = round(task_metrics.read_seconds, 3)
+                task.write_seconds = round(task_metrics.write_seconds, 3)
+                task.delete_seconds = round(task_metrics.delete_seconds, 3)
+
+            # Task-wise end time
+            end = timer()
+            total_seconds = end - start
+            duration = time.strftime("%H:%M:%S", time.gmtime(total_seconds))
+
+            with self.progress_lock:
+                # A partial run did not fail, its remaining days resume on the next run
+                if (task.task_status in ("Completed", "Partial")):
+                    self.total_passed_tasks = self.total_passed_tasks + 1
+                total_passed_tasks = self.total_passed_tasks
+                grand_total_duration = time.strftime("%H:%M:%S", time.gmtime(timer() - self.operation_start))
+
+            print(f"Archiving completed: {task.task_name}, Elapse Duration: {duration}")
+            self.log_info(f"Archiving completed: {task.task_name}, Elapse Duration: {duration}")
+
+            print(f"Total Completed Collections: {total_passed_tasks}/{self.total_collection}")
+            self.log_info(f"Total Completed Collections: {total_passed_tasks}/{self.total_collection}")
+
+            # Update Task into database
+            # update task
+            task.task_end_datetime=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            task.task_duration=duration
+            task.total_seconds=round(total_seconds, 3)
+
+            # Update task and master info into database in one transaction
+            with self.progress_lock:
+                operation_db_instance.operation_master.total_duration = grand_total_duration
+                operation_db_instance.operation_master.total_passed_tasks = total_passed_tasks
+                upd_task_status = operation_db_instance.update_task_progress(OperationDetail=task)
+
+            # Compact in the background when the deletes freed enough space, the task is saved first so the failure report is its only writer
+            if (total_deleted>0):
+                self.compaction_scheduler.schedule(collection_name=task.task_name, before=storage_before,
+                                                   on_failure=lambda remarks: self.report_compaction_failure(operation_db_instance, task, remarks))
+
+            print("****************************************************************************")
+            self.log_info("********************************************************************")
+
+            return True
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Error: {e}")
+
+            # Do not leave the task as In Progress
+            task.task_status="Failed"
+            task.remarks=f"Unable to archive {task.task_name} collection."
+            operation_db_instance.update_operation_detail(OperationDetail=task)
+            return None
+
+    # A background compaction failed, the task keeps its status and its remarks get the failure
+    def report_compaction_failure(self, operation_db_instance, task, remarks):
+        with self.progress_lock:
+            self.log_error(f"{remarks}")
+            print(f"{remarks}")
+            task.remarks = remarks if task.remarks in (None, "", "None") else f"{task.remarks} {remarks}"
+            operation_db_instance.update_operation_detail(OperationDetail=task, field_names=["remarks"])
+
     # Doing automation tasks
     def start_jobs(self):
         try:
@@ -29,7 +200,8 @@ class Automation(Logger):
             notification_instance = notification(logfile=notification_log_file)
 
             # Defind SQL execution Instance
-            db = DatabaseExecutor(operation_log)
+            db = self.create_executor()
+            self.compaction_scheduler = CompactionScheduler(logfile=operation_log, db=DatabaseExecutor(operation_log, self.operation_id))
             
             # Collection instance
             collection_list = XmlReader(logfile=operation_log)
@@ -46,6 +218,8 @@ class Automation(Logger):
 
             source_database_ip = get_variables().MONGODB_HOST
             destination_database_ip = get_variables().ARCHIVE_MONGODB_HOST
+            if (get_variables().ARCHIVE_TARGET=="FILE"):
+                destination_database_ip = get_variables().ARCHIVE_FILE_DIRECTORY
 
             operationMasterObj = OperationMaster(operation_id=self.operation_id,
                                                  operation_log=self.operation_log,
@@ -65,85 +239,58 @@ class Automation(Logger):
                                                  )
             load_status = operation_db_instance.setup_operation_database()
 
+            # Runtime forecast of every collection from its history and its backlog
+            forecaster = RuntimeForecaster(logfile=operation_log, db=db)
+            forecast_list = forecaster.forecast_tasks(task_list=operation_db_instance.operation_detail_lst)
+            operation_db_instance.update_operation_details(operation_db_instance.operation_detail_lst)
+
+            known_forecast_list = [forecast for forecast in forecast_list if forecast.forecast_seconds is not None]
+            forecast_seconds = sum(forecast.forecast_seconds for forecast in known_forecast_list)
+            print(f"Forecast of the run: {time.strftime('%H:%M:%S', time.gmtime(forecast_seconds))} for {len(known_forecast_list)}/{len(self.task_list)} collections with history")
+            self.log_info(f"Forecast of the run: {time.strftime('%H:%M:%S', time.gmtime(forecast_seconds))} for {len(known_forecast_list)}/{len(self.task_list)} collections with history")
+
+            # Collections ordered by priority and the schedule policy
+            self.task_scheduler = TaskScheduler(logfile=operation_log, collection_list=self.task_list)
+            scheduled_task_list = self.task_scheduler.order(task_list=operation_db_instance.operation_detail_lst, forecast_list=forecast_list)
+
             # timer
-            total_passed_tasks = 0
-            grand_total_seconds = 0
+            self.total_passed_tasks = 0
+            self.operation_start = timer()
+
+            # The maintenance window starts with the first collection
+            self.task_scheduler.start()
 
             # Get total collection 
             #collection_lst = collection_list.get_collection_list()
             #print(type(collection_lst))
 
-            total_collection = collection_list.total_collection
-
-            #for collection in collection_lst:
-            for task in operation_db_instance.operation_detail_lst:
-                # Timer
-                start = timer()
-
-                print("********************************************************************")
-                self.log_info("********************************************************************")
-                print(f"Archiving started: {task.task_name}")
-                print("===================================================")
-                self.log_info(f"Archiving started: {task.task_name}")
-                self.log_info("===================================================")
-
-                # Update Task Status
-                task.task_start_datetime=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                task.task_status = "In Progress"
-                task_status = task.task_status
-
-                # Update Task into database
-                upd_task_status = operation_db_instance.update_operation_detail(OperationDetail=task)
-
-                #total_deleted = db.delete_old_data(collection_name=collection.collection_name ,ts_field_name=collection.ts_field_name, id_field_name=collection.id_field_name)
-                total_deleted = db.delete_old_data_by_date(collection_name=task.task_name ,ts_field_name=task.ts_field_name, id_field_name=task.id_field_name)
-
-                # Update task status
-                if (total_deleted<0):
-                    task.task_status="Failed"
-                    task.remarks=f"Unable to archive {task.task_name} collection."
-                    self.log_error(f"{task.remarks}")
-                    print(f"{task.remarks}")
-                    #raise Exception(f"{task.remarks}")
-                else:
-                    total_passed_tasks = total_passed_tasks + 1
-                    task.task_status="Completed"
-                
-                # Compact database
-                compact_status = db.compact_collection(collection_name=task.task_name)
-                if (compact_status is None):
-                    task.remarks=f"Unable to compact {task.task_name} collection."
-                    self.log_error(f"{task.remarks}")
-                    print(f"{task.remarks}")
-
-                # Task-wise end time
-                end = timer()
-                total_seconds = end - start
-                duration = time.strftime("%H:%M:%S", time.gmtime(total_seconds))
-                grand_total_seconds=grand_total_seconds+total_seconds
-                #total_passed_tasks = total_passed_tasks + 1
-
-                print(f"Archiving completed: {task.task_name}, Elapse Duration: {duration}")
-                self.log_info(f"Archiving completed: {task.task_name}, Elapse Duration: {duration}")
-
-                print(f"Total Completed Collections: {total_passed_tasks}/{total_collection}")
-                self.log_info(f"Total Completed Collections: {total_passed_tasks}/{total_collection}")
-
-                grand_total_duration = time.strftime("%H:%M:%S", time.gmtime(grand_total_seconds))
-
-                # Update Task into database
-                # update task
-                task.task_end_datetime=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                task.task_duration=duration
-                upd_task_status = operation_db_instance.update_operation_detail(OperationDetail=task)
-
-                # Update master info into database
-                operation_db_instance.operation_master.total_duration = grand_total_duration
-                operation_db_instance.operation_master.total_passed_tasks = total_passed_tasks
-                upd_operation_status = operation_db_instance.update_operation_master()
+            self.total_collection = len(self.task_list)
+
+            # Number of collections archived at the same time
+            max_parallel_collections = max(1, get_variables().MAX_PARALLEL_COLLECTIONS)
+            print(f"Parallel collections: {max_parallel_collections}, engine: {self.engine}")
+            self.log_info(f"Parallel collections: {max_parallel_collections}, engine: {self.engine}")
+
+            if (max_parallel_collections==1):
+                try:
+                    for task in scheduled_task_list:
+                        self.run_task(db=db, operation_db_instance=operation_db_instance, task=task)
+                finally:
+                    db.close()
+            else:
+                with ThreadPoolExecutor(max_workers=max_parallel_collections, thread_name_prefix="archive") as executor:
+                    # Every worker gets its own executor instance, the workers take the tasks in the scheduled order
+                    futures = [executor.submit(self.run_worker_task, db, operation_db_instance, task)
+                               for task in scheduled_task_list]
+                    for future in as_completed(futures):
+                        future.result()
+                db.close()
+
+            # The run ends when the scheduled compactions are done
+            self.compaction_scheduler.wait()
 
-                print("****************************************************************************")
-                self.log_info("********************************************************************")
+            total_passed_tasks = self.total_passed_tasks
+            grand_total_seconds = timer() - self.operation_start
 
             # Grand Totol Duration
             grand_total_duration = time.strftime("%H:%M:%S", time.gmtime(grand_total_seconds))
@@ -0,0 +1,110 @@
+import threading
+import time
+from logger import *
+
+# Adjust the copy/delete batch size from the measured batch latency and the replication lag
+class BatchSizeController(Logger):
+    def __init__(self, logfile, initial_batch_size, min_batch_size, max_batch_size, target_latency_ms, max_replication_lag_seconds, lag_check_seconds, admin_database=None):
+        super().__init__(logfile)
+        self.min_batch_size = max(1, min_batch_size)
+        self.max_batch_size = max(self.min_batch_size, max_batch_size)
+        self.batch_size = min(max(initial_batch_size, self.min_batch_size), self.max_batch_size)
+        self.target_latency_seconds = target_latency_ms / 1000.0
+        self.max_replication_lag_seconds = max_replication_lag_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self.admin_database = admin_database
+
+        # Shards of a collection share the controller
+        self.lock = threading.Lock()
+        self.last_lag_check = 0
+        self.replication_lag_seconds = None
+        self.total_batches = 0
+        self.total_documents = 0
+
+    # Current batch size
+    def get_batch_size(self):
+        with self.lock:
+            return self.batch_size
+
+    # Average batch size used so far
+    def get_average_batch_size(self):
+        with self.lock:
+            if self.total_batches==0:
+                return self.batch_size
+            return int(self.total_documents / self.total_batches)
+
+    # Replication lag of the slowest secondary in seconds, None if it is not a replica set
+    def get_replication_lag(self):
+        try:
+            if self.admin_database is None:
+                return None
+
+            status = self.admin_database.command("replSetGetStatus")
+
+            primary_optime = None
+            secondary_optimes = []
+            for member in status.get("members", []):
+                if member.get("stateStr")=="PRIMARY":
+                    primary_optime = member.get("optimeDate")
+                elif member.get("stateStr")=="SECONDARY":
+                    secondary_optimes.append(member.get("optimeDate"))
+
+            if primary_optime is None or not secondary_optimes:
+                return None
+
+            return max(0, (primary_optime - min(secondary_optimes)).total_seconds())
+
+        except Exception as e:
+            # Standalone servers do not support replSetGetStatus, stop asking
+            self.log_warning(f"Replication lag is not available: {str(e)}")
+            self.admin_database = None
+            return None
+
+    # Block while the secondaries are behind the lag ceiling
+    def wait_for_replication(self):
+        while True:
+            with self.lock:
+                if (time.monotonic() - self.last_lag_check) < self.lag_check_seconds:
+                    return
+                self.last_lag_check = time.monotonic()
+
+            lag = self.get_replication_lag()
+            self.replication_lag_seconds = lag
+
+            if lag is None or lag<=self.max_replication_lag_seconds:
+                return
+
+            with self.lock:
+                self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+                batch_size = self.batch_size
+
+            print(f"Replication lag {lag:.1f}s is above {self.max_replication_lag_seconds}s, batch size {batch_size}, waiting {self.lag_check_seconds}s")
+            self.log_warning(f"Replication lag {lag:.1f}s is above {self.max_replication_lag_seconds}s, batch size {batch_size}, waiting {self.lag_check_seconds}s")
+            time.sleep(self.lag_check_seconds)
+
+    # Record a finished batch and choose the next batch size
+    def record(self, documents, latency_seconds):
+        with self.lock:
+            self.total_batches = self.total_batches + 1
+            self.total_documents = self.total_documents + documents
+
+            # Latency of a partial batch says nothing about the full one
+            if documents<self.batch_size:
+                return self.batch_size
+
+            previous_batch_size = self.batch_size
+
+            if latency_seconds>self.target_latency_seconds * 1.5:
+                self.batch_size = max(self.min_batch_size, int(self.batch_size * 0.5))
+            elif latency_seconds<self.target_latency_seconds * 0.75:
+                self.batch_size = min(self.max_batch_size, int(self.batch_size * 1.25) + 1)
+
+            batch_size = self.batch_size
+
+        if batch_size!=previous_batch_size:
+            print(f"Batch size changed {previous_batch_size} -> {batch_size}, last batch latency {latency_seconds*1000:.0f} ms")
+            self.log_info(f"Batch size changed {previous_batch_size} -> {batch_size}, last batch latency {latency_seconds*1000:.0f} ms")
+
+        self.wait_for_replication()
+
+        return batch_size
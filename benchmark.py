@@ -0,0 +1,289 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+from datetime_truncate import truncate
+from pymongo import MongoClient, ASCENDING
+
+# Synthetic collections shaped like the ones in collections.xml
+def make_erp_document(ts, rng):
+    return {
+        "businessDate": ts,
+        "branch": f"BR{rng.randint(1, 50):03d}",
+        "account": rng.randint(100000, 999999),
+        "currency": rng.choice(["USD", "EUR", "GBP", "BDT"]),
+        "amount": round(rng.uniform(1, 100000), 2),
+        "lines": [{"item": rng.randint(1, 5000), "quantity": rng.randint(1, 20), "price": round(rng.uniform(1, 500), 2)} for line_no in range(rng.randint(1, 8))],
+        "remarks": "x" * rng.randint(0, 200)
+    }
+
+def make_edit_log_document(ts, rng):
+    return {
+        "timeStamp": ts,
+        "user": f"user{rng.randint(1, 500)}",
+        "entity": rng.choice(["invoice", "voucher", "customer", "item"]),
+        "entityId": rng.randint(1, 10000000),
+        "action": rng.choice(["create", "update", "delete"]),
+        "before": {"status": rng.choice(["draft", "posted"]), "version": rng.randint(1, 50)},
+        "after": {"status": rng.choice(["posted", "void"]), "version": rng.randint(1, 50)}
+    }
+
+SHAPES = {
+    "erp": ("businessDate", make_erp_document),
+    "edit-log": ("timeStamp", make_edit_log_document)
+}
+
+# Documents per day, skew 0 spreads them evenly, a higher skew puts more of them on the oldest days
+def get_day_weights(days, skew):
+    weights = [math.exp(-skew * day_no / max(1, days - 1)) for day_no in range(days)]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+# Drop and fill the source collection, expired days end before the retention cutoff and one recent day is kept
+def generate_collection(database, shape, days, docs_per_day, skew, retention_days, seed):
+    ts_field_name, make_document = SHAPES[shape]
+    rng = random.Random(seed)
+    collection = database[shape]
+    collection.drop()
+
+    cutoff_day = truncate(datetime.utcnow() - timedelta(days=retention_days), 'day')
+    total_docs = days * docs_per_day
+    day_list = [(cutoff_day - timedelta(days=days - day_no), round(total_docs * weight)) for day_no, weight in enumerate(get_day_weights(days, skew))]
+    day_list.append((truncate(datetime.utcnow(), 'day'), docs_per_day))
+
+    generated = 0
+    for day, day_docs in day_list:
+        batch = []
+        for doc_no in range(day_docs):
+            batch.append(make_document(day + timedelta(seconds=rng.randint(0, 86399)), rng))
+            if len(batch)>=5000:
+                collection.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+        generated = generated + day_docs
+
+    collection.create_index([(ts_field_name, ASCENDING)])
+    return generated
+
+# Peak resident memory of this process in bytes
+def get_peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system()=="Darwin" else peak * 1024
+
+def get_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+# Sink wrapper that sums the time spent in the archive writes
+class TimedArchiveSink:
+    def __init__(self, sink, timings):
+        self.sink = sink
+        self.timings = timings
+        self.is_durable = sink.is_durable
+
+    def record(self, seconds):
+        with self.timings["lock"]:
+            self.timings["copy_seconds"] = self.timings["copy_seconds"] + seconds
+            self.timings["copy_batches"] = self.timings["copy_batches"] + 1
+
+    def write(self, batch):
+        start = timer()
+        try:
+            return self.sink.write(batch)
+        finally:
+            self.record(timer() - start)
+
+    async def write_async(self, batch):
+        start = timer()
+        try:
+            return await self.sink.write_async(batch)
+        finally:
+            self.record(timer() - start)
+
+    def flush(self):
+        return self.sink.flush()
+
+    def commit(self):
+        return self.sink.commit()
+
+# Executor of the engine with the copy and delete calls timed
+def create_timed_executor(engine, logfile, timings):
+    if (engine=="ASYNC"):
+        from async_engine import AsyncDatabaseExecutor as base_class
+    else:
+        from db import DatabaseExecutor as base_class
+
+    class TimedDatabaseExecutor(base_class):
+        def time_sink(self, sink):
+            if sink is None or isinstance(sink, TimedArchiveSink):
+                return sink
+            return TimedArchiveSink(sink, timings)
+
+        def create_archive_sink(self, collection_name, day):
+            return self.time_sink(super().create_archive_sink(collection_name, day))
+
+        def create_async_archive_sink(self, state, day):
+            return self.time_sink(super().create_async_archive_sink(state, day))
+
+        # Only the sync engine deletes through delete_by_ids
+        def delete_by_ids(self, source_collection, filter_condition, id_field_name, ids):
+            start = timer()
+            try:
+                return super().delete_by_ids(source_collection, filter_condition, id_field_name, ids)
+            finally:
+                with timings["lock"]:
+                    timings["delete_seconds"] = timings["delete_seconds"] + timer() - start
+
+    return TimedDatabaseExecutor(logfile)
+
+# One engine, batch size and shape, run in a process of its own so that the peak RSS belongs to this case
+def run_case(case):
+    logfile = os.path.join(case["work_directory"], "benchmark.log")
+    timings = {"lock": threading.Lock(), "copy_seconds": 0.0, "copy_batches": 0, "delete_seconds": 0.0}
+    executor = create_timed_executor(case["engine"], logfile, timings)
+
+    # The benchmark database replaces the one of cred/.env
+    executor.host = executor.host_archive = case["host"]
+    executor.port = executor.port_archive = case["port"]
+    executor.username = executor.username_archive = None
+    executor.password = executor.password_archive = None
+    executor.database = case["database"]
+    executor.database_archive = case["database"] + "-archive"
+    executor.data_retention_days = case["retention_days"]
+    executor.batch_size = case["batch_size"]
+    executor.is_archive_enabled = "YES"
+    executor.archive_target = case["target"]
+    executor.archive_file_directory = os.path.join(case["work_directory"], "archive")
+
+    ts_field_name = SHAPES[case["shape"]][0]
+    phases = {}
+
+    cpu_start = get_cpu_seconds()
+    run_start = timer()
+
+    # The entry point of a scheduled run, planning, checkpoints and shards included
+    phase_start = timer()
+    total_deleted = executor.delete_old_data_by_date(collection_name=case["shape"], ts_field_name=ts_field_name, id_field_name="_id")
+    task_seconds = timer() - phase_start
+
+    # Task metrics are missing when the task failed before it started
+    task_metrics = executor.last_task_metrics.finish() if executor.last_task_metrics is not None else None
+    plan_seconds = task_metrics.plan_seconds if task_metrics is not None and task_metrics.plan_seconds is not None else 0.0
+    deleted = task_metrics.docs_deleted if task_metrics is not None else 0
+
+    phases["plan"] = plan_seconds
+    phases["archive"] = task_seconds - plan_seconds
+    phases["copy"] = timings["copy_seconds"]
+    phases["delete"] = timings["delete_seconds"] if case["engine"]=="SYNC" else None
+
+    phase_start = timer()
+    executor.compact_collection(collection_name=case["shape"])
+    phases["compact"] = timer() - phase_start
+    executor.close()
+
+    run_seconds = timer() - run_start
+
+    return {
+        "shape": case["shape"],
+        "engine": case["engine"],
+        "batch_size": case["batch_size"],
+        "target": case["target"],
+        "expired_docs": task_metrics.backlog_docs if task_metrics is not None else None,
+        "deleted_docs": deleted,
+        "failed": total_deleted is None or total_deleted<0,
+        "seconds": run_seconds,
+        "docs_per_second": round(deleted / phases["archive"], 1) if phases["archive"]>0 else None,
+        "cpu_seconds": get_cpu_seconds() - cpu_start,
+        "peak_rss_bytes": get_peak_rss(),
+        "copy_batches": timings["copy_batches"],
+        "phases": phases
+    }
+
+# Commit of the tree under test, results of different commits are compared by it
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the archive engines against a local mongod")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="27017")
+    parser.add_argument("--database", default="archive-benchmark")
+    parser.add_argument("--shapes", nargs="+", choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument("--engines", nargs="+", choices=["SYNC", "ASYNC"], type=str.upper, default=["SYNC"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1000, 5000])
+    parser.add_argument("--target", choices=["MONGODB", "FILE", "NULL"], type=str.upper, default="MONGODB")
+    parser.add_argument("--days", type=int, default=7, help="expired days per collection")
+    parser.add_argument("--docs-per-day", type=int, default=10000)
+    parser.add_argument("--skew", type=float, default=0.0, help="0 for even days, higher values put more documents on the oldest days")
+    parser.add_argument("--retention-days", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON results, benchmark_results/<commit>-<time>.json by default")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process, one case
+    if args.run_case:
+        with open(args.run_case) as case_file:
+            case = json.load(case_file)
+        # Checkpoints of the case go to a database of its own, the settings read the real environment first
+        os.environ["AUTOMATION_DB"] = case["automation_db"]
+        result = run_case(case)
+        with open(case["result_file"], "w") as result_file:
+            json.dump(result, result_file)
+        sys.exit(0)
+
+    source_client = MongoClient(f"mongodb://{args.host}:{args.port}/")
+    source_database = source_client[args.database]
+
+    result_list = []
+    with tempfile.TemporaryDirectory(prefix="archive-benchmark-") as work_directory:
+        for shape in args.shapes:
+            for engine in args.engines:
+                for batch_size in args.batch_sizes:
+                    # Every case starts from the same data
+                    generated = generate_collection(database=source_database, shape=shape, days=args.days, docs_per_day=args.docs_per_day, skew=args.skew,
+                                                    retention_days=args.retention_days, seed=args.seed)
+                    source_client[args.database + "-archive"][shape].drop()
+                    print(f"Generated {generated} {shape} documents, running {engine} with batch size {batch_size}")
+
+                    case = {"shape": shape, "engine": engine, "batch_size": batch_size, "target": args.target, "host": args.host, "port": args.port,
+                            "database": args.database, "retention_days": args.retention_days, "work_directory": work_directory,
+                            "automation_db": os.path.join(work_directory, f"automation-{shape}-{engine}-{batch_size}.db"),
+                            "result_file": os.path.join(work_directory, "result.json")}
+                    case_path = os.path.join(work_directory, "case.json")
+                    with open(case_path, "w") as case_file:
+                        json.dump(case, case_file)
+
+                    subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", case_path], check=True)
+                    with open(case["result_file"]) as result_file:
+                        result = json.load(result_file)
+
+                    print(f"{shape} {engine} {batch_size}: {result['docs_per_second']} docs/s, {result['cpu_seconds']:.1f} CPU s, peak RSS {result['peak_rss_bytes'] // (1024 * 1024)} MB, phases {result['phases']}")
+                    result_list.append(result)
+
+    source_client.close()
+
+    commit = get_git_commit()
+    output = args.output or os.path.join("benchmark_results", f"{commit or 'unknown'}-{datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    with open(output, "w") as output_file:
+        json.dump({"commit": commit, "created": datetime.now().isoformat(), "python": platform.python_version(),
+                   "settings": {"days": args.days, "docs_per_day": args.docs_per_day, "skew": args.skew, "retention_days": args.retention_days, "seed": args.seed},
+                   "results": result_list}, output_file, indent=2)
+
+    print(f"Results: {output}")
@@ -0,0 +1,77 @@
+import struct
+import bson
+from bson.raw_bson import RawBSONDocument
+
+# Size of the fixed length BSON element values, by type byte
+FIXED_VALUE_SIZES = {
+    0x01: 8,   # double
+    0x06: 0,   # undefined
+    0x07: 12,  # ObjectId
+    0x08: 1,   # boolean
+    0x09: 8,   # UTC datetime
+    0x0A: 0,   # null
+    0x10: 4,   # int32
+    0x11: 8,   # timestamp
+    0x12: 8,   # int64
+    0x13: 16,  # decimal128
+    0x7F: 0,   # max key
+    0xFF: 0    # min key
+}
+
+# Size of the value that starts at offset
+def get_value_size(data, element_type, offset):
+    if element_type in FIXED_VALUE_SIZES:
+        return FIXED_VALUE_SIZES[element_type]
+
+    # string, JavaScript code, symbol: int32 length then the bytes
+    if element_type in (0x02, 0x0D, 0x0E):
+        return 4 + struct.unpack_from("<i", data, offset)[0]
+
+    # embedded document, array, code with scope: int32 total length
+    if element_type in (0x03, 0x04, 0x0F):
+        return struct.unpack_from("<i", data, offset)[0]
+
+    # binary: int32 length, subtype byte, then the bytes
+    if element_type==0x05:
+        return 5 + struct.unpack_from("<i", data, offset)[0]
+
+    # regular expression: pattern and options cstrings
+    if element_type==0x0B:
+        pattern_end = data.index(b"\x00", offset)
+        options_end = data.index(b"\x00", pattern_end + 1)
+        return options_end + 1 - offset
+
+    # DBPointer: string then ObjectId
+    if element_type==0x0C:
+        return 4 + struct.unpack_from("<i", data, offset)[0] + 12
+
+    raise ValueError(f"Unknown BSON element type {element_type}")
+
+# Decode one top-level field of a raw BSON document, the other fields are skipped without decoding
+def get_raw_field(data, field_name):
+    key = field_name.encode("utf-8")
+    document_size = struct.unpack_from("<i", data, 0)[0]
+
+    offset = 4
+    while offset<document_size - 1:
+        element_start = offset
+        element_type = data[offset]
+        name_end = data.index(b"\x00", offset + 1)
+        value_start = name_end + 1
+        value_end = value_start + get_value_size(data, element_type, value_start)
+
+        if data[offset + 1:name_end]==key:
+            # Wrap the single element into a document of its own and decode only that
+            element = bytes(data[element_start:value_end])
+            return bson.decode(struct.pack("<i", len(element) + 5) + element + b"\x00")[field_name]
+
+        offset = value_end
+
+    raise KeyError(field_name)
+
+# Value of a top-level field, only that field is decoded from a raw document
+def get_document_field(document, field_name):
+    if isinstance(document, RawBSONDocument):
+        return get_raw_field(document.raw, field_name)
+
+    return document[field_name]
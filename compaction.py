@@ -0,0 +1,135 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger import *
+from setting import get_variables
+
+# Storage of one collection, summed over the shards of a sharded cluster
+class StorageStatistics:
+    def __init__(self, size, storage_size, free_storage_size):
+        self.size = size
+        self.storage_size = storage_size
+        self.free_storage_size = free_storage_size
+
+    def __str__(self):
+        return f"Data Size: {self.size}, Storage Size: {self.storage_size}, Free Storage Size: {self.free_storage_size}"
+
+# Compaction as a stage of its own, a collection is compacted in the background when enough space is reusable
+class CompactionScheduler(Logger):
+    def __init__(self, logfile, db):
+        super().__init__(logfile)
+        self.db = db
+        self.compact_mode = get_variables().COMPACT_MODE
+        self.min_free_bytes = get_variables().COMPACT_MIN_FREE_MB * 1024 * 1024
+        self.min_free_percent = get_variables().COMPACT_MIN_FREE_PERCENT
+
+        # One compaction at a time, compact is heavy on the server
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compact")
+        self.futures = []
+        self.lock = threading.Lock()
+
+    # Storage statistics of a collection, None when they cannot be read
+    def read_storage_statistics(self, collection_name):
+        try:
+            collection = self.db.get_database()[collection_name]
+
+            size = 0
+            storage_size = 0
+            free_storage_size = 0
+            for stats in collection.aggregate([{"$collStats": {"storageStats": {}}}]):
+                storage_stats = stats["storageStats"]
+                size = size + storage_stats.get("size", 0)
+                storage_size = storage_size + storage_stats.get("storageSize", 0)
+
+                # freeStorageSize exists since 4.4, older servers report the WiredTiger block manager
+                if "freeStorageSize" in storage_stats:
+                    free_storage_size = free_storage_size + storage_stats["freeStorageSize"]
+                else:
+                    free_storage_size = free_storage_size + storage_stats.get("wiredTiger", {}).get("block-manager", {}).get("file bytes available for reuse", 0)
+
+            return StorageStatistics(size=size, storage_size=storage_size, free_storage_size=free_storage_size)
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    # Compact only when the reusable space passes both thresholds
+    def is_compaction_needed(self, collection_name, before, after):
+        if (after is None):
+            return False
+
+        deleted_bytes = max(0, before.size - after.size) if before is not None else None
+        free_percent = (after.free_storage_size * 100.0 / after.storage_size) if after.storage_size else 0
+
+        print(f"Storage [{collection_name}]: {deleted_bytes} bytes deleted, {after.free_storage_size} bytes reusable ({free_percent:.1f}%)")
+        self.log_info(f"Storage [{collection_name}]: {deleted_bytes} bytes deleted, {after.free_storage_size} bytes reusable ({free_percent:.1f}%)")
+
+        return after.free_storage_size>=self.min_free_bytes and free_percent>=self.min_free_percent
+
+    # Queue the compaction of a collection after its deletes, on_failure(remarks) is called if it fails
+    def schedule(self, collection_name, before, on_failure=None):
+        if (self.compact_mode=="NONE"):
+            return None
+
+        after = self.read_storage_statistics(collection_name)
+        if not self.is_compaction_needed(collection_name=collection_name, before=before, after=after):
+            print(f"Compaction skipped: {collection_name}")
+            self.log_info(f"Compaction skipped: {collection_name}")
+            return None
+
+        future = self.executor.submit(self.compact, collection_name, on_failure)
+        with self.lock:
+            self.futures.append(future)
+
+        print(f"Compaction scheduled: {collection_name}")
+        self.log_info(f"Compaction scheduled: {collection_name}")
+
+        return future
+
+    # Secondaries first in ROLLING mode, the primary last
+    def compact(self, collection_name, on_failure=None):
+        try:
+            if (self.compact_mode=="ROLLING"):
+                for host, port in self.get_secondaries():
+                    if (self.db.compact_member(host=host, port=port, collection_name=collection_name) is None):
+                        raise Exception(f"Compaction is failed on {host}:{port}")
+
+            if (self.db.compact_collection(collection_name=collection_name) is None):
+                raise Exception("Compaction is failed on the primary")
+
+            print(f"Compaction completed: {collection_name}")
+            self.log_info(f"Compaction completed: {collection_name}")
+            return True
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            if on_failure is not None:
+                on_failure(f"Unable to compact {collection_name} collection.")
+            return None  # Error
+
+    # Secondaries of the replica set, empty for a standalone server
+    def get_secondaries(self):
+        try:
+            status = self.db.connect().admin.command("replSetGetStatus")
+            secondaries = []
+            for member in status.get("members", []):
+                if member.get("stateStr")=="SECONDARY":
+                    host, port = member["name"].rsplit(":", 1)
+                    secondaries.append((host, port))
+            return secondaries
+
+        except Exception as e:
+            self.log_warning(f"Secondaries are not available: {str(e)}")
+            return []
+
+    # Wait for the scheduled compactions, called once at the end of the run
+    def wait(self):
+        with self.lock:
+            futures = list(self.futures)
+            self.futures = []
+
+        for future in futures:
+            future.result()
+
+        self.executor.shutdown(wait=True)
@@ -1,13 +1,28 @@
-from pymongo import MongoClient, ASCENDING
+from pymongo import ASCENDING
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from bson_reader import get_document_field
 from datetime import datetime, timedelta
 from datetime_truncate import truncate
 import math
+from concurrent.futures import ThreadPoolExecutor
 from setting import get_variables
+from mongo_client import get_client
 from logger import *
+from planner import ArchivePlanner, TimeShard
+from batch_controller import BatchSizeController
+from timeit import default_timer as timer
+from operationdb import ArchiveCheckpointData
+from pipeline import ArchivePipeline
+import metrics
+from id_buffer import IdBuffer
+from archive_sink import MongoArchiveSink, NullArchiveSink
+from file_archive import FileArchiveSink
 
 class DatabaseExecutor(Logger):
-    def __init__(self, logfile):
+    def __init__(self, logfile, operation_id=None):
         super().__init__(logfile)
+        self.operation_id = operation_id
         self.host = get_variables().MONGODB_HOST
         self.port = get_variables().MONGODB_PORT
         self.database = get_variables().MONGODB_DATABASE_NAME
@@ -15,6 +30,28 @@ class DatabaseExecutor(Logger):
         self.password = get_variables().MONGODB_PASSWORD
         self.data_retention_days = get_variables().DATA_RETENTION_DAYS
         self.batch_size = get_variables().BATCH_SIZE
+        self.shard_count = get_variables().ARCHIVE_SHARD_COUNT
+        self.max_concurrent_shards = get_variables().MAX_CONCURRENT_SHARDS
+
+        # Adaptive batch size
+        self.is_adaptive_batch_enabled = get_variables().ADAPTIVE_BATCH_ENABLED
+        self.min_batch_size = get_variables().MIN_BATCH_SIZE
+        self.max_batch_size = get_variables().MAX_BATCH_SIZE
+        self.target_batch_latency_ms = get_variables().TARGET_BATCH_LATENCY_MS
+        self.max_replication_lag_seconds = get_variables().MAX_REPLICATION_LAG_SECONDS
+        self.replication_lag_check_seconds = get_variables().REPLICATION_LAG_CHECK_SECONDS
+        self.last_batch_size = self.batch_size
+
+        # Volume and seconds of the last collection, reported to the operation database
+        self.last_task_metrics = None
+
+        # timer() value after which no new day is started, set per collection by the scheduler
+        self.deadline = None
+        self.is_stopped_by_deadline = False
+
+        # Planning statistics are cached per run
+        self.planner = ArchivePlanner(logfile)
+        self.retention_cutoff = None
 
         # Archive
         self.host_archive = get_variables().ARCHIVE_MONGODB_HOST
@@ -23,12 +60,23 @@ class DatabaseExecutor(Logger):
         self.username_archive = get_variables().ARCHIVE_MONGODB_USERNAME
         self.password_archive = get_variables().ARCHIVE_MONGODB_PASSWORD
         self.is_archive_enabled = get_variables().IS_ARCHIVE_ENABLED
+        self.archive_write_mode = get_variables().ARCHIVE_WRITE_MODE
+        self.archive_writer_threads = get_variables().ARCHIVE_WRITER_THREADS
+        self.is_raw_bson_enabled = get_variables().ARCHIVE_RAW_BSON_ENABLED
+        self.pipeline_queue_depth = get_variables().PIPELINE_QUEUE_DEPTH
+
+        # File archive
+        self.archive_target = get_variables().ARCHIVE_TARGET
+        self.archive_file_directory = get_variables().ARCHIVE_FILE_DIRECTORY
+        self.archive_file_compression = get_variables().ARCHIVE_FILE_COMPRESSION
+        self.archive_file_compression_level = get_variables().ARCHIVE_FILE_COMPRESSION_LEVEL
     
     # Connection method
     def connect(self):
         try:
 
-            connection = MongoClient(f"mongodb://{self.host}:{self.port}/", username=self.username, password=self.password)
+            # Shared client, the connection pool is created once per run
+            connection = get_client(name="source", host=self.host, port=self.port, username=self.username, password=self.password)
 
             return connection  # Success
         
@@ -53,7 +101,8 @@ class DatabaseExecutor(Logger):
     def connect_archive(self):
         try:
 
-            connection = MongoClient(f"mongodb://{self.host_archive}:{self.port_archive}/", username=self.username_archive, password=self.password_archive)
+            # Shared client, the connection pool is created once per run
+            connection = get_client(name="archive", host=self.host_archive, port=self.port_archive, username=self.username_archive, password=self.password_archive)
 
             return connection  # Success
         
@@ -74,6 +123,33 @@ class DatabaseExecutor(Logger):
             self.log_error(f"Exception: {str(e)}")
             return None  # Error
         
+    # Sink for the documents of one collection and day, None when IS_ARCHIVE_ENABLED is not YES
+    def create_archive_sink(self, collection_name, day):
+        if (self.is_archive_enabled!="YES"):
+            return None
+
+        if (self.archive_target=="NULL"):
+            return NullArchiveSink(logfile=self.log_file, collection_name=collection_name, day=day)
+
+        if (self.archive_target=="FILE"):
+            return FileArchiveSink(logfile=self.log_file, directory=self.archive_file_directory, database=self.database, collection_name=collection_name, day=day,
+                                   compression=self.archive_file_compression, compression_level=self.archive_file_compression_level, operation_id=self.operation_id)
+
+        db_archive = self.get_database_archive()
+        return MongoArchiveSink(logfile=self.log_file, collection=db_archive[collection_name], day=day, write_mode=self.archive_write_mode)
+
+    # The day is complete in the sink
+    def commit_archive_sink(self, archive_sink):
+        if (archive_sink is None):
+            return None
+
+        summary = archive_sink.commit()
+        if summary is not None:
+            print(f"Archive committed: {summary}")
+            self.log_info(f"Archive committed: {summary}")
+
+        return summary
+
     # Create Index
     def create_index(self, collection_name, field_name):
         try:
@@ -104,41 +180,219 @@ class DatabaseExecutor(Logger):
             self.log_error(f"Exception: {str(e)}")
             return None  # Error
 
-    # Archive Data
-    def archive_data(self, source_collection, archive_collection, filter_condition):
+    # Yield documents from a cursor in lists of at most batch_size documents
+    def fetch_batches(self, cursor, batch_size, batch_controller=None, collection_name=None):
+        read_seconds = metrics.batch_read_seconds.labels(collection_name)
+
+        # Size of the batch read when it starts, the controller lock is not taken for every document
+        batch = []
+        limit = batch_controller.get_batch_size() if batch_controller else batch_size
+        read_start = timer()
+        for document in cursor:
+            batch.append(document)
+            if len(batch) >= limit:
+                # Time spent in the cursor only, the consumer's time is not counted
+                read_seconds.observe(timer() - read_start)
+                yield batch
+                batch = []
+                limit = batch_controller.get_batch_size() if batch_controller else batch_size
+                read_start = timer()
+
+        if batch:
+            read_seconds.observe(timer() - read_start)
+            yield batch
+
+    # Archive Data, the ids of the archived documents are collected into id_buffer when it is given
+    def archive_data(self, source_collection, archive_sink, filter_condition, id_field_name=None, id_buffer=None):
+        total_records_inserted = 0
+
         try:
             
             # print(f"filter_condition : {filter_condition}")
             # self.log_info(f"filter_condition : {filter_condition}")
 
-            # Fetch data
-            data = source_collection.find(filter_condition)
+            batch_size = self.batch_size
 
-            cnt = len(list(data))
-            # print(f"Count : {cnt}")
+            # Stream data, the server returns batch_size documents per round trip
+            read_collection = self.get_raw_collection(source_collection) if (self.is_raw_bson_enabled=="YES" or self.archive_target!="MONGODB") else source_collection
+            cursor = read_collection.find(filter_condition).batch_size(batch_size)
+
+            try:
+                chunk_no = 0
+                for batch in self.fetch_batches(cursor=cursor, batch_size=batch_size, collection_name=source_collection.name):
+                    chunk_no = chunk_no + 1
 
-            if cnt>0: # Check empty document
-                
-                try:
                     # Insert batch into destination collection
-                    result =  archive_collection.insert_many(data, ordered=False)
+                    confirmed, records_inserted, records_duplicated, confirmed_bytes = self.write_archive_batch(archive_sink=archive_sink, collection_name=source_collection.name, batch=batch)
+                    if len(confirmed)<len(batch):
+                        raise Exception(f"{len(batch) - len(confirmed)} records of chunk {chunk_no} are not archived!")
 
-                    total_records_inserted = len(result.inserted_ids)
+                    total_records_inserted = total_records_inserted + records_inserted
 
-                    print(f"Archived {total_records_inserted} records.")
-                    self.log_info(f"Archived {total_records_inserted} records.")
-                
-                except Exception as e:
-                    print(f"Error: {e}")
-                    self.log_error(f"Exception: {str(e)}")
+                    if id_buffer is not None and archive_sink.is_durable:
+                        id_buffer.extend(self.get_document_id(document, id_field_name) for document in confirmed)
 
-            return True
+                    print(f"Archived chunk {chunk_no}: {records_inserted} new, {records_duplicated} already present, total {total_records_inserted}.")
+                    self.log_info(f"Archived chunk {chunk_no}: {records_inserted} new, {records_duplicated} already present, total {total_records_inserted}.")
+            finally:
+                cursor.close()
+
+            if total_records_inserted>0:
+                print(f"Archived {total_records_inserted} records.")
+                self.log_info(f"Archived {total_records_inserted} records.")
+
+            return total_records_inserted
         
         except Exception as e:
             print(f"Error: {e}")
             self.log_error(f"Exception: {str(e)}")
             return None  # Error   
         
+    # Same collection, documents are returned as undecoded RawBSONDocument
+    def get_raw_collection(self, collection):
+        return collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument, tz_aware=collection.codec_options.tz_aware))
+
+    # Value of a top-level field, only that field is decoded from a raw document
+    def get_document_id(self, document, field_name):
+        return get_document_field(document, field_name)
+
+    # Only id_field_name of the documents in the filter, the query is covered when an index holds both fields
+    def harvest_ids(self, source_collection, filter_condition, id_field_name, id_buffer):
+        projection = {id_field_name: 1}
+        if (id_field_name!="_id"):
+            projection["_id"] = 0
+
+        cursor = source_collection.find(filter_condition, projection=projection).batch_size(self.batch_size)
+        try:
+            for document in cursor:
+                id_buffer.append(document[id_field_name])
+        finally:
+            cursor.close()
+
+        return id_buffer
+
+    # Write a batch into the sink and count what the archive confirmed
+    def write_archive_batch(self, archive_sink, collection_name, batch):
+        write_start = timer()
+        confirmed, records_inserted, records_duplicated = archive_sink.write(batch)
+        metrics.batch_write_seconds.labels(collection_name).observe(timer() - write_start)
+
+        # Measured once per batch, the delete reuses the bytes of the confirmed documents
+        confirmed_bytes = metrics.get_batch_bytes(confirmed)
+        if archive_sink.is_durable:
+            metrics.documents_copied.labels(collection_name).inc(len(confirmed))
+            metrics.bytes_copied.labels(collection_name).inc(confirmed_bytes)
+
+        return confirmed, records_inserted, records_duplicated, confirmed_bytes
+
+    # Delete exactly the given ids, restricted to the archived time window
+    def delete_by_ids(self, source_collection, filter_condition, id_field_name, ids):
+        if not ids:
+            return 0
+
+        delete_start = timer()
+        result = source_collection.delete_many({"$and": [filter_condition, {id_field_name: {"$in": ids}}]})
+        metrics.batch_delete_seconds.labels(source_collection.name).observe(timer() - delete_start)
+        metrics.documents_deleted.labels(source_collection.name).inc(result.deleted_count)
+
+        return result.deleted_count
+
+    # Archive one batch and delete its confirmed ids from the source, return the counts of the batch
+    def process_batch(self, source_collection, archive_sink, filter_condition, id_field_name, chunk_no, batch, batch_controller=None):
+        batch_start = timer()
+        in_flight = metrics.batches_in_flight.labels(source_collection.name)
+        in_flight.inc()
+
+        try:
+            records_inserted = 0
+            records_duplicated = 0
+            confirmed = batch
+            confirmed_bytes = 0
+            if (archive_sink is not None):
+                confirmed, records_inserted, records_duplicated, confirmed_bytes = self.write_archive_batch(archive_sink=archive_sink, collection_name=source_collection.name, batch=batch)
+            records_failed = len(batch) - len(confirmed)
+
+            # A sink that keeps nothing leaves the source untouched
+            if (archive_sink is not None and not archive_sink.is_durable):
+                confirmed = []
+
+            ids = [self.get_document_id(document, id_field_name) for document in confirmed]
+            records_deleted = self.delete_by_ids(source_collection=source_collection, filter_condition=filter_condition, id_field_name=id_field_name, ids=ids)
+            if ids:
+                # Estimated from the confirmed documents, a document deleted meanwhile by someone else is not told apart
+                metrics.bytes_deleted.labels(source_collection.name).inc(int(confirmed_bytes * records_deleted / len(ids)))
+        finally:
+            in_flight.dec()
+
+        if batch_controller:
+            batch_controller.record(documents=len(batch), latency_seconds=timer() - batch_start)
+
+        print(f"Chunk {chunk_no}: read {len(batch)}, archived {records_inserted} new, {records_duplicated} already present, deleted {records_deleted}")
+        self.log_info(f"Chunk {chunk_no}: read {len(batch)}, archived {records_inserted} new, {records_duplicated} already present, deleted {records_deleted}")
+
+        return {
+            "inserted": records_inserted,
+            "duplicated": records_duplicated,
+            "deleted": records_deleted,
+            "failed": records_failed,
+            "last_id": ids[-1] if ids else None
+        }
+
+    # Copy documents to the archive and delete from the source only the ids confirmed in the archive
+    def archive_and_delete_data(self, source_collection, archive_sink, filter_condition, id_field_name, batch_controller=None):
+        try:
+            batch_size = batch_controller.get_batch_size() if batch_controller else self.batch_size
+            is_archive_enabled = (archive_sink is not None)
+            is_pipeline_enabled = is_archive_enabled and self.archive_writer_threads>0
+
+            # Without archive only the ids are needed for the delete
+            projection = None if is_archive_enabled else {id_field_name: 1}
+
+            # Raw BSON batches are copied verbatim, they are never decoded into dicts
+            read_collection = source_collection
+            if is_archive_enabled and (self.is_raw_bson_enabled=="YES" or is_pipeline_enabled or self.archive_target!="MONGODB"):
+                read_collection = self.get_raw_collection(source_collection)
+
+            cursor = read_collection.find(filter_condition, projection=projection).batch_size(batch_size)
+
+            try:
+                batches = self.fetch_batches(cursor=cursor, batch_size=batch_size, batch_controller=batch_controller, collection_name=source_collection.name)
+
+                def write_batch(chunk_no, batch):
+                    return self.process_batch(source_collection=source_collection, archive_sink=archive_sink, filter_condition=filter_condition,
+                                              id_field_name=id_field_name, chunk_no=chunk_no, batch=batch, batch_controller=batch_controller)
+
+                if is_pipeline_enabled:
+                    # Reader thread and writer threads keep both clusters busy
+                    pipeline = ArchivePipeline(logfile=self.log_file, queue_depth=self.pipeline_queue_depth, writer_threads=self.archive_writer_threads)
+                    batch_results = pipeline.run(batches=batches, write_batch=write_batch, collection_name=source_collection.name)
+                else:
+                    batch_results = [write_batch(chunk_no, batch) for chunk_no, batch in enumerate(batches, start=1)]
+            finally:
+                cursor.close()
+
+            total_archived = sum(result["inserted"] for result in batch_results)
+            total_duplicates = sum(result["duplicated"] for result in batch_results)
+            total_deleted = sum(result["deleted"] for result in batch_results)
+            total_failed = sum(result["failed"] for result in batch_results)
+            last_id = next((result["last_id"] for result in reversed(batch_results) if result["last_id"] is not None), None)
+
+            if total_duplicates>0:
+                print(f"{total_duplicates} records were already archived by an earlier attempt.")
+                self.log_info(f"{total_duplicates} records were already archived by an earlier attempt.")
+
+            if total_failed>0:
+                print(f"Error: {total_failed} records could not be archived and are kept in the source.")
+                self.log_error(f"{total_failed} records could not be archived and are kept in the source.")
+                return None
+
+            return total_archived, total_deleted, last_id
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
     # Get record counts
     def get_records_count(self, collection_name, filter_criteria):
         total_docs = 0
@@ -149,26 +403,8 @@ class DatabaseExecutor(Logger):
             db = self.get_database()
             collection = db[collection_name]
 
-            # Aggregation pipeline
-            pipeline = [
-                    {"$match": filter_criteria},  # Match documents based on filter criteria
-                    {"$group": {
-                        "_id": None,
-                        "count": {"$sum": 1}
-                    }},
-                    {"$project": {
-                        "_id": 0,
-                        "count": 1
-                    }}
-                    ]
-
-            # Execute the aggregation pipeline
-            result = list(collection.aggregate(pipeline))
-
-            if result:
-                total_docs = result[0]["count"]
-            else:
-                total_docs = 0
+            # Count from the index, no document is fetched
+            total_docs = self.planner.count(collection=collection, filter_criteria=filter_criteria)
 
             return total_docs
         
@@ -177,9 +413,151 @@ class DatabaseExecutor(Logger):
             self.log_error(f"Exception: {str(e)}")
             return total_docs  # Error
             
+    # The sync executor uses the shared clients of mongo_client, it has nothing of its own to close
+    def close(self):
+        pass
+
+    # A day written to a sink that keeps nothing is not archived, it must not advance the checkpoint
+    def is_sink_durable(self, archive_sink):
+        return archive_sink is None or archive_sink.is_durable
+
+    # Time budget of the collection is used up, the shards stop between days and resume on the next run
+    def is_deadline_passed(self):
+        return self.deadline is not None and timer()>=self.deadline
+
+    # Retention cutoff of the run, computed on first use so that every task and the planner cache agree
+    def get_retention_cutoff(self):
+        if (self.retention_cutoff is None):
+            self.retention_cutoff = datetime.utcnow() - timedelta(days=int(self.data_retention_days))
+
+        return self.retention_cutoff
+
+    # Batch size controller for one collection, a fixed size unless ADAPTIVE_BATCH_ENABLED is YES
+    def create_batch_controller(self):
+        if (self.is_adaptive_batch_enabled=="YES"):
+            return BatchSizeController(logfile=self.log_file,
+                                       initial_batch_size=self.batch_size,
+                                       min_batch_size=self.min_batch_size,
+                                       max_batch_size=self.max_batch_size,
+                                       target_latency_ms=self.target_batch_latency_ms,
+                                       max_replication_lag_seconds=self.max_replication_lag_seconds,
+                                       lag_check_seconds=self.replication_lag_check_seconds,
+                                       admin_database=self.connect().admin)
+
+        return BatchSizeController(logfile=self.log_file,
+                                   initial_batch_size=self.batch_size,
+                                   min_batch_size=self.batch_size,
+                                   max_batch_size=self.batch_size,
+                                   target_latency_ms=self.target_batch_latency_ms,
+                                   max_replication_lag_seconds=self.max_replication_lag_seconds,
+                                   lag_check_seconds=self.replication_lag_check_seconds)
+
+    # Shards of [from_date, to_date), unfinished shards of a previous run are resumed from their checkpoint
+    def plan_shards(self, collection, ts_field_name, from_date, to_date, total_docs, checkpoint_data, index_name=None):
+        try:
+            shard_list = []
+            planned_until = from_date
+
+            checkpoint_list = checkpoint_data.read_by_collection(collection_name=collection.name) or []
+            for checkpoint in checkpoint_list:
+                if (checkpoint.shard_status=="Completed"):
+                    continue
+
+                shard_start = datetime.fromisoformat(checkpoint.last_archived_date or checkpoint.shard_start)
+                shard_end = min(datetime.fromisoformat(checkpoint.shard_end), to_date)
+                if (shard_start<shard_end):
+                    shard_list.append(TimeShard(shard_no=checkpoint.shard_no, start_date=shard_start, end_date=shard_end, estimated_docs=None))
+                    print(f"Resuming shard {checkpoint.shard_no} from {shard_start}")
+                    self.log_info(f"Resuming shard {checkpoint.shard_no} from {shard_start}")
+
+            if shard_list:
+                # Only the period after the previous plan is new
+                planned_until = max(datetime.fromisoformat(checkpoint.shard_end) for checkpoint in checkpoint_list)
+                if (planned_until<to_date):
+                    shard_list.append(TimeShard(shard_no=max(checkpoint.shard_no for checkpoint in checkpoint_list) + 1, start_date=planned_until, end_date=to_date, estimated_docs=None))
+            elif (self.shard_count>1):
+                # Split the retention window into shards with a similar number of documents
+                shard_list = self.planner.get_time_shards(collection=collection, ts_field_name=ts_field_name, from_date=from_date, to_date=to_date, shard_count=self.shard_count, index_name=index_name)
+                if (shard_list is None):
+                    return None
+            else:
+                shard_list = [TimeShard(shard_no=1, start_date=from_date, end_date=to_date, estimated_docs=total_docs)]
+
+            checkpoint_data.save_plan(collection_name=collection.name, operation_id=self.operation_id, shard_list=shard_list)
+
+            return shard_list
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    # Archive and delete one time shard day by day, return the number of deleted documents
+    def archive_time_range(self, collection, ts_field_name, id_field_name, shard, total_docs, batch_controller=None, checkpoint_data=None):
+        total_deleted = 0
+
+        try:
+            print(f"Shard {shard.shard_no} started: {shard.start_date} - {shard.end_date}")
+            self.log_info(f"Shard {shard.shard_no} started: {shard.start_date} - {shard.end_date}")
+
+            from_date = shard.start_date
+
+            while (from_date<shard.end_date and not self.is_deadline_passed()):
+                
+                start_date = from_date
+                end_date = min(truncate(start_date, 'day') + timedelta(days=1), shard.end_date)
+
+                filter_condition = {ts_field_name: {"$gte": start_date, "$lt": end_date}}
+
+                # Archive records and delete the archived ids
+                archive_sink = self.create_archive_sink(collection_name=collection.name, day=start_date)
+                try:
+                    archive_status = self.archive_and_delete_data(source_collection=collection, archive_sink=archive_sink, filter_condition=filter_condition, id_field_name=id_field_name, batch_controller=batch_controller)
+                finally:
+                    self.commit_archive_sink(archive_sink)
+                if (archive_status is None):
+                    print(f"Shard {shard.shard_no}: archive is failed at {start_date}!")
+                    self.log_error(f"Shard {shard.shard_no}: archive is failed at {start_date}!")
+                    return None
+
+                total_archived, deleted_count, last_id = archive_status
+ 
+                if (deleted_count>0):
+                    total_deleted += deleted_count
+                    print(f"Deleted [{start_date}]: {total_deleted} documents in shard {shard.shard_no}, {total_docs} expired in total")
+                    self.log_info(f"Deleted [{start_date}]: {total_deleted} documents in shard {shard.shard_no}, {total_docs} expired in total")
+
+                # The day is archived and deleted, a new run resumes after it
+                if (checkpoint_data is not None and self.is_sink_durable(archive_sink)):
+                    checkpoint_data.update_progress(collection_name=collection.name, shard_no=shard.shard_no, last_archived_date=end_date, last_id=last_id,
+                                                    shard_status="Completed" if end_date>=shard.end_date else "In Progress")
+
+                # Next date
+                from_date = end_date
+
+            if (from_date<shard.end_date):
+                self.is_stopped_by_deadline = True
+                print(f"Shard {shard.shard_no} stopped at {from_date}, the time budget is used up: {total_deleted} documents deleted")
+                self.log_warning(f"Shard {shard.shard_no} stopped at {from_date}, the time budget is used up: {total_deleted} documents deleted")
+                return total_deleted
+
+            print(f"Shard {shard.shard_no} completed: {total_deleted} documents deleted")
+            self.log_info(f"Shard {shard.shard_no} completed: {total_deleted} documents deleted")
+
+            return total_deleted
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
     # Remove data from a collection by timestmap
     def delete_old_data_by_date(self, collection_name, ts_field_name, id_field_name):
         total_deleted = 0
+        task_metrics = metrics.TaskMetrics(collection_name)
+        self.last_task_metrics = task_metrics
+        self.is_stopped_by_deadline = False
+        plan_start = timer()
 
         try:
 
@@ -187,17 +565,13 @@ class DatabaseExecutor(Logger):
             db = self.get_database()
             collection = db[collection_name]
 
-            # Archive database
-            db_archive = self.get_database_archive()
-            collection_archive = db_archive[collection_name]
-
             # Create index on the date field for faster query
             index_name = self.create_index(collection_name=collection_name, field_name=ts_field_name)
             print(f"Index using: {index_name}")
             self.log_info(f"Index using: {index_name}")
 
-            # Calculate the date X days ago
-            retention_days_ago = datetime.utcnow() - timedelta(days=int(self.data_retention_days))
+            # Calculate the date X days ago, the same cutoff is used for the whole run
+            retention_days_ago = self.get_retention_cutoff()
             print(f"Data Retention From: {retention_days_ago}")
             self.log_info(f"Data Retention From: {retention_days_ago}")
 
@@ -206,38 +580,19 @@ class DatabaseExecutor(Logger):
             print(f"Executing: {query}")
             self.log_info(f"Executing: {query}")
 
-            filter_criteria = {ts_field_name : {"$lt" : retention_days_ago} }
+            # Min, max and count from the timestamp index, cached for the run
+            statistics = self.planner.get_range_statistics(collection=collection, ts_field_name=ts_field_name, cutoff_date=retention_days_ago, index_name=index_name)
+            if (statistics is None):
+                raise Exception("Unable to read the range statistics!")
 
-            # Aggregation pipeline
-            pipeline = [
-                    {"$match": filter_criteria},  # Match documents based on filter criteria
-                    {"$group": {
-                        "_id": None,
-                        "min_date": {"$min": f"${ts_field_name}"},
-                        "max_date": {"$max": f"${ts_field_name}"},
-                        "count": {"$sum": 1}
-                    }},
-                    {"$project": {
-                        "_id": 0,
-                        "min_date": 1,
-                        "max_date": 1,
-                        "count": 1
-                    }}
-                    ]
-
-            # Execute the aggregation pipeline
-            result = list(collection.aggregate(pipeline))
             # Print minimum and maximum dates
             from_date = truncate(datetime.now(), 'day')
             to_date = from_date
 
-            if result:
-                from_date = result[0]['min_date']
-                to_date = result[0]['max_date']
-                total_docs = result[0]["count"]
-
-                from_date = truncate(from_date, 'day')
-                to_date = truncate(to_date, 'day')
+            if (statistics.count>0):
+                from_date = truncate(statistics.min_date, 'day')
+                to_date = truncate(statistics.max_date, 'day')
+                total_docs = statistics.count
 
             else:
                 from_date = to_date + timedelta(days=1)
@@ -245,17 +600,21 @@ class DatabaseExecutor(Logger):
                 print("No documents match the filter criteria.")
                 self.log_info("No documents match the filter criteria.")
 
+            task_metrics.backlog_docs = total_docs
+
         
             batch_size = self.batch_size  # Adjust batch size as needed  
+            batch_controller = self.create_batch_controller()
+            self.last_batch_size = batch_controller.get_batch_size()
 
             print(f"Total records for deletion: {total_docs}")
-            #print(f"Batch Size: {batch_size}")
+            print(f"Batch Size: {batch_size}, adaptive: {self.is_adaptive_batch_enabled}")
             
             print(f"Archive Start Date: {from_date}")
             print(f"Archive End Date: {to_date}")
 
             self.log_info(f"Total records for deletion : {total_docs}")
-            #self.log_info(f"Batch Size: {batch_size}")
+            self.log_info(f"Batch Size: {batch_size}, adaptive: {self.is_adaptive_batch_enabled}")
             self.log_info(f"Archive Start Date: {from_date}")
             self.log_info(f"Archive End Date: {to_date}")
 
@@ -264,31 +623,47 @@ class DatabaseExecutor(Logger):
             # print(f"Total iterations = {iterations}")
             # self.log_info(f"Total iterations = {iterations}")
 
-            while (from_date<=to_date):
-                
-                start_date = from_date
-                end_date = start_date + timedelta(days=1)
+            if (from_date>to_date):
+                task_metrics.plan_seconds = timer() - plan_start
+                return total_deleted
 
-                filter_condition = {ts_field_name: {"$gte": start_date, "$lt": end_date}}
+            # Resume the unfinished shards of an interrupted run, otherwise plan new shards
+            checkpoint_data = ArchiveCheckpointData(self.log_file)
+            shard_list = self.plan_shards(collection=collection, ts_field_name=ts_field_name, from_date=from_date, to_date=retention_days_ago, total_docs=total_docs, checkpoint_data=checkpoint_data, index_name=index_name)
+            if (shard_list is None):
+                raise Exception("Unable to split the retention window into shards!")
+            task_metrics.plan_seconds = timer() - plan_start
 
-                # Archive records
-                if (self.is_archive_enabled=="YES"):
-                    archive_status = self.archive_data(source_collection=collection, archive_collection=collection_archive, filter_condition=filter_condition)
-                    if (archive_status==None or archive_status==False):
-                        print("Archive is failed!")
-                        self.log_error("Archive is failed!")
-                        break
-                # Delete records
-                result = collection.delete_many(filter_condition)
-                #result = collection.delete_many({ts_field_name: {"$gte": start_date, "$lt": end_date}})
- 
-                if (result.deleted_count>0):
-                    total_deleted += result.deleted_count
-                    print(f"Deleted [{start_date}]: {total_deleted}/{total_docs} documents")
-                    self.log_info(f"Deleted [{start_date}]: {total_deleted}/{total_docs} documents")
+            print(f"Total shards: {len(shard_list)}, concurrent shards: {self.max_concurrent_shards}")
+            self.log_info(f"Total shards: {len(shard_list)}, concurrent shards: {self.max_concurrent_shards}")
 
-                # Next date
-                from_date = from_date + timedelta(days=1)
+            if (len(shard_list)==1 or self.max_concurrent_shards<=1):
+                shard_results = [self.archive_time_range(collection=collection, ts_field_name=ts_field_name, id_field_name=id_field_name, shard=shard, total_docs=total_docs, batch_controller=batch_controller, checkpoint_data=checkpoint_data)
+                                 for shard in shard_list]
+            else:
+                with ThreadPoolExecutor(max_workers=self.max_concurrent_shards, thread_name_prefix=f"shard-{collection_name}") as executor:
+                    shard_results = list(executor.map(lambda shard: self.archive_time_range(collection=collection, ts_field_name=ts_field_name, id_field_name=id_field_name, shard=shard, total_docs=total_docs, batch_controller=batch_controller, checkpoint_data=checkpoint_data),
+                                                      shard_list))
+
+            # Batch size reported to the operation database
+            self.last_batch_size = batch_controller.get_average_batch_size()
+            print(f"Average batch size: {self.last_batch_size}")
+            self.log_info(f"Average batch size: {self.last_batch_size}")
+
+            failed_shards = 0
+            for shard_deleted in shard_results:
+                if (shard_deleted is None):
+                    print("Archive is failed!")
+                    self.log_error("Archive is failed!")
+                    failed_shards = failed_shards + 1
+                    continue
+                total_deleted += shard_deleted
+
+            # Part of the retention window is not archived, the collection is not complete
+            if (failed_shards>0):
+                print(f"{failed_shards} of {len(shard_results)} shards failed, {total_deleted} documents deleted by the others")
+                self.log_error(f"{failed_shards} of {len(shard_results)} shards failed, {total_deleted} documents deleted by the others")
+                return -1
 
             return total_deleted
         
@@ -308,10 +683,6 @@ class DatabaseExecutor(Logger):
             db = self.get_database()
             collection = db[collection_name]
 
-            # Archive database
-            db_archive = self.get_database_archive()
-            collection_archive = db_archive[collection_name]
-
             # Create index on the date field for faster query
             index_name = self.create_index(collection_name=collection_name, field_name=ts_field_name)
             print(f"Index using: {index_name}")
@@ -335,20 +706,8 @@ class DatabaseExecutor(Logger):
 
             filter_criteria = {ts_field_name : {"$lt" : retention_days_ago} }
 
-            # Aggregation pipeline to count number of documents
-            pipeline = [
-                { "$match": filter_criteria },  # Filter documents
-                {
-                    "$group": {
-                        "_id": None,
-                        "count": {"$sum": 1}
-                    }
-                }
-            ]
-
-            # Execute the aggregation pipeline
-            result = list(collection.aggregate(pipeline))
-            total_docs = result[0]["count"]
+            # Count from the index, no document is fetched
+            total_docs = self.planner.count(collection=collection, filter_criteria=filter_criteria, index_name=index_name)
 
             batch_size = self.batch_size  # Adjust batch size as needed                    
             print(f"Total documents: {total_docs}")
@@ -362,29 +721,30 @@ class DatabaseExecutor(Logger):
             print(f"Total iterations = {iterations}")
             self.log_info(f"Total iterations = {iterations}")
 
-            total_deleted = 0
-            while (total_deleted<=total_docs):
-                # Fetch documents older than 30 days in the current batch
-                documents = collection.find({ts_field_name: {"$lt": retention_days_ago}}).limit(batch_size)
-
-                # If Archive is enabled, insert records into archive database
-                if (self.is_archive_enabled=="YES"):
-                    archive_status = self.archive_data(archive_collection=collection_archive, data=documents, batch_size=batch_size)
-                    if (archive_status==None or archive_status==False):
-                        print("Archive is failed!")
-                        self.log_error("Archive is failed!")
-                        break
-
-                # Get document IDs to delete
-                ids_to_delete = [doc[id_field_name] for doc in documents]
-
-                # Check if there are no more documents to delete
-                if not ids_to_delete:
-                    break
-
-                # Delete documents in the current batch
-                result = collection.delete_many({id_field_name: {"$in": ids_to_delete}})
-                total_deleted += result.deleted_count
+            # Ids are kept packed, ObjectIds take 12 bytes each instead of a whole document
+            id_buffer = IdBuffer()
+
+            # If Archive is enabled, the ids are taken from the archived documents
+            if (self.is_archive_enabled=="YES"):
+                # The sink of this path is labelled with the retention cutoff day
+                archive_sink = self.create_archive_sink(collection_name=collection_name, day=retention_days_ago)
+                try:
+                    archive_status = self.archive_data(source_collection=collection, archive_sink=archive_sink, filter_condition=filter_criteria, id_field_name=id_field_name, id_buffer=id_buffer)
+                finally:
+                    self.commit_archive_sink(archive_sink)
+                if (archive_status is None):
+                    print("Archive is failed!")
+                    self.log_error("Archive is failed!")
+                    return total_deleted
+            else:
+                self.harvest_ids(source_collection=collection, filter_condition=filter_criteria, id_field_name=id_field_name, id_buffer=id_buffer)
+
+            print(f"Ids to delete: {len(id_buffer)}, {id_buffer.size_in_bytes()} bytes")
+            self.log_info(f"Ids to delete: {len(id_buffer)}, {id_buffer.size_in_bytes()} bytes")
+
+            # Delete documents in batches of at most batch_size ids
+            for ids_to_delete in id_buffer.chunks(batch_size):
+                total_deleted += self.delete_by_ids(source_collection=collection, filter_condition=filter_criteria, id_field_name=id_field_name, ids=ids_to_delete)
                 print(f"Deleted: {total_deleted}/{total_docs}")
                 self.log_info(f"Deleted: {total_deleted}/{total_docs}")
 
@@ -412,6 +772,20 @@ class DatabaseExecutor(Logger):
             self.log_error(f"Exception: {str(e)}")
             return None  # Error
     
+    # Compact a collection on one member of the replica set, used to compact the secondaries first
+    def compact_member(self, host, port, collection_name):
+        try:
+            connection = get_client(name=f"member-{host}:{port}", host=host, port=port, username=self.username, password=self.password, direct_connection=True)
+            result = connection[self.database].command('compact', collection_name)
+            print(f"Compact operation completed on {host}:{port}.")
+            self.log_info(f"Compact operation completed on {host}:{port}.")
+            return True
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
     # Compact Database
     def compact_database(self):
         try:
@@ -3,7 +3,7 @@
 DROP TABLE operation;
 
 CREATE TABLE operation(
-	operation_id VARCHAR(128) NOT NULL,
+	operation_id VARCHAR(128) NOT NULL PRIMARY KEY,
 	operation_log text,
 	start_datetime	text NOT NULL,
 	end_datetime	text,
@@ -15,6 +15,8 @@ CREATE TABLE operation(
 	total_passed_tasks	INTEGER
 );
 
+CREATE INDEX idx_operation_start_datetime ON operation(start_datetime);
+
 
 -- operation_details definition
 
@@ -22,14 +24,79 @@ DROP TABLE operation_details;
 
 CREATE TABLE operation_details(
 	operation_id VARCHAR(128) NOT null,
-	task_id	INTEGER,
+	task_id	INTEGER NOT NULL,
 	task_name VARCHAR(100) not null,
 	task_description text not null,
 	task_start_datetime text,
 	task_end_datetime	text,
 	task_duration text,
-	task_status VARCHAR(20),	
+	task_status VARCHAR(20),
 	remarks	text,
 	id_field_name text,
-	ts_field_name text
-);
\ No newline at end of file
+	ts_field_name text,
+	batch_size INTEGER,
+	backlog_docs INTEGER,
+	docs_copied INTEGER,
+	docs_deleted INTEGER,
+	bytes_copied INTEGER,
+	bytes_deleted INTEGER,
+	plan_seconds REAL,
+	read_seconds REAL,
+	write_seconds REAL,
+	delete_seconds REAL,
+	total_seconds REAL,
+	forecast_seconds REAL,
+	PRIMARY KEY (operation_id, task_id)
+);
+
+
+-- archive_checkpoint definition
+
+DROP TABLE archive_checkpoint;
+
+CREATE TABLE archive_checkpoint(
+	collection_name VARCHAR(100) NOT NULL,
+	shard_no INTEGER NOT NULL,
+	shard_start text NOT NULL,
+	shard_end text NOT NULL,
+	last_archived_date text,
+	last_id text,
+	shard_status VARCHAR(20) NOT NULL,
+	operation_id VARCHAR(128),
+	updated_datetime text,
+	PRIMARY KEY (collection_name, shard_no)
+);
+
+
+-- operation_daily_summary definition, operations older than OPERATION_RETENTION_DAYS
+
+DROP TABLE operation_daily_summary;
+
+CREATE TABLE operation_daily_summary(
+	summary_date text NOT NULL PRIMARY KEY,
+	total_operations INTEGER NOT NULL,
+	completed_operations INTEGER NOT NULL,
+	total_tasks INTEGER NOT NULL,
+	total_passed_tasks INTEGER NOT NULL,
+	total_seconds INTEGER NOT NULL
+);
+
+
+-- task_daily_summary definition
+
+DROP TABLE task_daily_summary;
+
+CREATE TABLE task_daily_summary(
+	summary_date text NOT NULL,
+	task_name VARCHAR(100) NOT NULL,
+	total_runs INTEGER NOT NULL,
+	completed_runs INTEGER NOT NULL,
+	total_seconds INTEGER NOT NULL,
+	docs_deleted INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY (summary_date, task_name)
+);
+
+
+-- schema migrations applied, see SCHEMA_MIGRATIONS in operationdb.py
+
+PRAGMA user_version = 5;
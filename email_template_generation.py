@@ -15,6 +15,8 @@ class email_template(Logger):
         self.total_task = total_task
         self.completed_tasks = completed_tasks
         self.task_list= task_list
+        self.remaining_forecast_seconds = None
+        self.max_parallel_collections = max(1, get_variables().MAX_PARALLEL_COLLECTIONS)
         self.email_template_file = get_variables().EMAIL_TEMPLATE
         self.task_tr = """<tr style="height: 18px;">
 <td style="width: 35.8594px; height: 18px;">&nbsp;{task_id}</td>
@@ -22,6 +24,7 @@ class email_template(Logger):
 <td style="width: 132.203px; height: 18px;">{start_time}</td>
 <td style="width: 137.859px; height: 18px;">{task_status}</td>
 <td style="width: 183.172px; height: 18px;">{task_duration}</td>
+<td style="width: 183.172px; height: 18px;">{task_forecast}</td>
 </tr>
 """
     
@@ -66,10 +69,19 @@ class email_template(Logger):
             self.log_error(f"Exception: {str(e)}")
             return total_seconds
             
+    # Forecast seconds as HH:MM:SS, 'None' when the collection has no history
+    def format_forecast(self, forecast_seconds):
+        if (forecast_seconds is None):
+            return 'None'
+
+        return time.strftime("%H:%M:%S", time.gmtime(forecast_seconds))
+
     # Generate table for list of tasks
     def generate_task_table(self):
         task_table = ""
         self.current_task_duration_seconds = 0
+        remaining_seconds = 0
+        remaining_tasks = 0
         try:
             tr = self.task_tr
             for task in self.task_list:
@@ -79,14 +91,24 @@ class email_template(Logger):
                 if (str(task.task_status)=='In Progress'):
                     task.task_duration = self.get_duration(start_datetime=task.task_start_datetime, end_datetime=task.task_end_datetime)
 
+                # Forecast left of the collections still to run
+                if (str(task.task_status) in ('Not Started', 'In Progress') and task.forecast_seconds is not None):
+                    elapsed_seconds = self.convert_duration_into_seconds(duration_str=str(task.task_duration)) if str(task.task_status)=='In Progress' else 0
+                    remaining_seconds = remaining_seconds + max(0, task.forecast_seconds - elapsed_seconds)
+                    remaining_tasks = remaining_tasks + 1
+
                 start_time=""
                 if (task.task_start_datetime!='None'):
                     start_time = str(task.task_start_datetime).split(" ")[1]
                 else:
                     start_time = task.task_start_datetime
 
-                new_tr = tr.replace("{task_id}", str(task.task_id)).replace("{task_name}", str(task.task_name)).replace("{start_time}", start_time).replace("{task_status}", str(task.task_status)).replace("{task_duration}", str(task.task_duration))
+                new_tr = tr.replace("{task_id}", str(task.task_id)).replace("{task_name}", str(task.task_name)).replace("{start_time}", start_time).replace("{task_status}", str(task.task_status)).replace("{task_duration}", str(task.task_duration)).replace("{task_forecast}", self.format_forecast(task.forecast_seconds))
                 task_table = task_table + new_tr
+
+            # Collections run side by side on MAX_PARALLEL_COLLECTIONS workers
+            if (remaining_tasks>0):
+                self.remaining_forecast_seconds = remaining_seconds / min(self.max_parallel_collections, remaining_tasks)
             
             return task_table
         
@@ -122,6 +144,7 @@ class email_template(Logger):
             template = template.replace("{total_duration}", str(self.total_duration))
             template = template.replace("{total_task}", str(self.total_task))
             template = template.replace("{completed_tasks}", str(self.completed_tasks))
+            template = template.replace("{remaining_forecast}", self.format_forecast(self.remaining_forecast_seconds))
             template = template.replace("{task_list}", task_tr_lst)
 
             email_body = template
@@ -0,0 +1,195 @@
+import json
+from datetime import datetime, timedelta
+from datetime_truncate import truncate
+from timeit import default_timer as timer
+from db import DatabaseExecutor
+from xml_reader import XmlReader
+from setting import get_variables
+
+# Expired documents of one day
+class DayEstimate:
+    def __init__(self, start_date, end_date, docs, bytes, index_name):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.docs = docs
+        self.bytes = bytes
+        self.index_name = index_name
+
+    def to_dict(self):
+        return {"start_date": self.start_date.isoformat(), "end_date": self.end_date.isoformat(), "docs": self.docs, "bytes": self.bytes, "index_name": self.index_name}
+
+    def __str__(self):
+        return f"Day: {self.start_date.strftime('%Y-%m-%d')}, Docs: {self.docs}, Bytes: {self.bytes}, Index: {self.index_name}"
+
+# Archive cost of one collection
+# The dry run writes and deletes nothing, the projected seconds cover reading the source only and are a lower bound of the run
+class CollectionEstimate:
+    def __init__(self, collection_name, ts_field_name, index_name, day_list, avg_document_bytes, read_docs_per_second):
+        self.collection_name = collection_name
+        self.ts_field_name = ts_field_name
+        self.index_name = index_name
+        self.day_list = day_list
+        self.avg_document_bytes = avg_document_bytes
+        self.read_docs_per_second = read_docs_per_second
+        self.total_docs = sum(day.docs for day in day_list)
+        self.total_bytes = sum(day.bytes for day in day_list)
+        self.projected_read_seconds = self.total_docs / read_docs_per_second if read_docs_per_second else None
+
+    def to_dict(self):
+        return {"collection_name": self.collection_name, "ts_field_name": self.ts_field_name, "index_name": self.index_name,
+                "total_docs": self.total_docs, "total_bytes": self.total_bytes, "avg_document_bytes": self.avg_document_bytes,
+                "read_docs_per_second": self.read_docs_per_second, "projected_read_seconds": self.projected_read_seconds,
+                "days": [day.to_dict() for day in self.day_list]}
+
+    def __str__(self):
+        return f"Collection: {self.collection_name}, Index: {self.index_name}, Docs: {self.total_docs}, Bytes: {self.total_bytes}, Read docs/s: {self.read_docs_per_second}, Projected read seconds: {self.projected_read_seconds}"
+
+# Dry run, plans every collection of the XML file and estimates its cost, nothing is created, written or deleted
+class ArchiveEstimator(DatabaseExecutor):
+    def __init__(self, logfile, operation_id=None):
+        super().__init__(logfile, operation_id)
+        self.sample_size = get_variables().DRY_RUN_SAMPLE_SIZE
+
+    # Existing index on the timestamp field, create_index is not used because it would build one
+    def find_index(self, collection, ts_field_name):
+        for index_name, index in collection.index_information().items():
+            if index["key"][0][0]==ts_field_name:
+                return index_name
+
+        return None
+
+    # Index chosen by the query planner for a filter, the plan is not executed
+    def explain_index(self, collection, filter_condition):
+        explain = collection.database.command("explain", {"find": collection.name, "filter": filter_condition}, verbosity="queryPlanner")
+
+        # A sharded cluster reports the plan of every shard
+        winning_plan = explain["queryPlanner"]["winningPlan"]
+        if "shards" in winning_plan:
+            winning_plan = winning_plan["shards"][0]["winningPlan"]
+
+        stage = winning_plan
+        while stage is not None:
+            if "indexName" in stage:
+                return stage["indexName"]
+            stage = stage.get("inputStage") or (stage.get("inputStages") or [None])[0]
+
+        return "COLLSCAN"
+
+    # Average BSON size of sampled documents
+    def sample_document_bytes(self, collection, filter_condition):
+        pipeline = [
+            {"$match": filter_condition},
+            {"$sample": {"size": self.sample_size}},
+            {"$group": {"_id": None, "avg_bytes": {"$avg": {"$bsonSize": "$$ROOT"}}}}
+        ]
+        result = list(collection.aggregate(pipeline))
+        if not result:
+            return 0
+
+        return int(result[0]["avg_bytes"] or 0)
+
+    # Documents per second read from the source, timed on the first sample_size documents of the filter
+    # Archive writes and deletes are not timed, the run is slower than this rate
+    def measure_throughput(self, collection, filter_condition):
+        start = timer()
+        cursor = collection.find(filter_condition).limit(self.sample_size).batch_size(self.batch_size)
+        try:
+            docs = sum(1 for document in cursor)
+        finally:
+            cursor.close()
+        seconds = timer() - start
+
+        if docs==0 or seconds<=0:
+            return None
+
+        return round(docs / seconds, 1)
+
+    # Plan one collection day by day as delete_old_data_by_date would
+    def estimate_collection(self, collection_name, ts_field_name):
+        try:
+            collection = self.get_database()[collection_name]
+            index_name = self.find_index(collection=collection, ts_field_name=ts_field_name)
+            if (index_name is None):
+                print(f"No index on {collection_name}.{ts_field_name}, the archive run would create one.")
+                self.log_info(f"No index on {collection_name}.{ts_field_name}, the archive run would create one.")
+
+            cutoff_date = self.get_retention_cutoff()
+            statistics = self.planner.get_range_statistics(collection=collection, ts_field_name=ts_field_name, cutoff_date=cutoff_date, index_name=index_name)
+            if (statistics is None):
+                raise Exception("Unable to read the range statistics!")
+
+            day_list = []
+            avg_document_bytes = 0
+            read_docs_per_second = None
+
+            if (statistics.count>0):
+                expired_filter = {ts_field_name: {"$lt": cutoff_date}}
+                avg_document_bytes = self.sample_document_bytes(collection=collection, filter_condition=expired_filter)
+                read_docs_per_second = self.measure_throughput(collection=collection, filter_condition=expired_filter)
+
+                from_date = truncate(statistics.min_date, 'day')
+                while (from_date<cutoff_date):
+                    end_date = min(truncate(from_date, 'day') + timedelta(days=1), cutoff_date)
+                    filter_condition = {ts_field_name: {"$gte": from_date, "$lt": end_date}}
+
+                    docs = self.planner.count(collection=collection, filter_criteria=filter_condition, index_name=index_name)
+                    if (docs>0):
+                        day = DayEstimate(start_date=from_date, end_date=end_date, docs=docs, bytes=docs * avg_document_bytes,
+                                          index_name=self.explain_index(collection=collection, filter_condition=filter_condition))
+                        day_list.append(day)
+                        print(day)
+                        self.log_info(str(day))
+
+                    from_date = end_date
+
+            estimate = CollectionEstimate(collection_name=collection_name, ts_field_name=ts_field_name, index_name=index_name, day_list=day_list,
+                                          avg_document_bytes=avg_document_bytes, read_docs_per_second=read_docs_per_second)
+            print(estimate)
+            self.log_info(str(estimate))
+
+            return estimate
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    # Estimate every collection of the XML file, the report is also written as JSON when report_path is given
+    def run(self, report_path=None):
+        try:
+            task_list = XmlReader(logfile=self.log_file).get_task_list()
+
+            estimate_list = []
+            for task in task_list:
+                estimate = self.estimate_collection(collection_name=task.task_name, ts_field_name=task.ts_field_name)
+                if (estimate is not None):
+                    estimate_list.append(estimate)
+
+            total_docs = sum(estimate.total_docs for estimate in estimate_list)
+            total_bytes = sum(estimate.total_bytes for estimate in estimate_list)
+            projected_read_seconds = sum(estimate.projected_read_seconds or 0 for estimate in estimate_list)
+
+            print(f"Dry run: {len(estimate_list)}/{len(task_list)} collections, {total_docs} documents, {total_bytes} bytes, projected read {timedelta(seconds=int(projected_read_seconds))} (archive writes and deletes not included)")
+            self.log_info(f"Dry run: {len(estimate_list)}/{len(task_list)} collections, {total_docs} documents, {total_bytes} bytes, projected read {timedelta(seconds=int(projected_read_seconds))} (archive writes and deletes not included)")
+
+            report = {
+                "created": datetime.now().isoformat(),
+                "retention_cutoff": self.get_retention_cutoff().isoformat(),
+                "total_docs": total_docs,
+                "total_bytes": total_bytes,
+                "projected_read_seconds": projected_read_seconds,
+                "collections": [estimate.to_dict() for estimate in estimate_list]
+            }
+
+            if report_path:
+                with open(report_path, "w") as report_file:
+                    json.dump(report, report_file, indent=2)
+                print(f"Dry run report: {report_path}")
+                self.log_info(f"Dry run report: {report_path}")
+
+            return report
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
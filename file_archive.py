@@ -0,0 +1,129 @@
+import gzip
+import io
+import json
+import os
+import threading
+from datetime import datetime
+import bson
+from bson.raw_bson import RawBSONDocument
+from archive_sink import ArchiveSink
+
+# One JSON line per closed archive file
+MANIFEST_FILE = "manifest.jsonl"
+
+FILE_EXTENSIONS = {
+    "ZSTD": ".bson.zst",
+    "GZIP": ".bson.gz",
+    "NONE": ".bson"
+}
+
+# The manifest is shared by every collection and thread
+manifest_lock = threading.Lock()
+
+# Compress one batch into a frame of its own, concatenated frames decompress as one stream
+def get_compressor(compression, compression_level):
+    if (compression=="ZSTD"):
+        # zstandard is only needed by the file archive
+        import zstandard
+        return zstandard.ZstdCompressor(level=compression_level).compress
+
+    if (compression=="GZIP"):
+        return lambda data: gzip.compress(data, compresslevel=compression_level)
+
+    return lambda data: data
+
+# BSON bytes of a document, raw documents are written as they were read
+def encode_document(document):
+    if isinstance(document, RawBSONDocument):
+        return document.raw
+
+    return bson.encode(document)
+
+# Documents of one collection and day, written batch by batch into one file
+class FileArchiveSink(ArchiveSink):
+    def __init__(self, logfile, directory, database, collection_name, day, compression, compression_level, operation_id=None):
+        super().__init__(logfile, collection_name, day)
+        self.directory = directory
+        self.database = database
+        self.compression = compression
+        self.operation_id = operation_id or "manual"
+        self.compress = get_compressor(compression, compression_level)
+
+        # A resumed day gets a new file, the files of an earlier attempt are kept
+        file_name = f"part-{self.operation_id}-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}{FILE_EXTENSIONS[compression]}"
+        self.path = os.path.join(directory, database, collection_name, day.strftime("%Y-%m-%d"), file_name)
+
+        self.file = None
+        self.documents = 0
+        self.bytes = 0
+        self.compressed_bytes = 0
+        self.created = None
+        self.lock = threading.Lock()
+
+    # Append a batch, the documents are on disk when it returns so the source can delete them
+    def write(self, batch):
+        data = b"".join(encode_document(document) for document in batch)
+        compressed = self.compress(data)
+
+        with self.lock:
+            # The file is created with the first batch, an empty day leaves no file
+            if self.file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, "ab")
+                self.created = datetime.utcnow()
+
+            self.file.write(compressed)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+            self.documents = self.documents + len(batch)
+            self.bytes = self.bytes + len(data)
+            self.compressed_bytes = self.compressed_bytes + len(compressed)
+
+        return batch, len(batch), 0
+
+    # Close the file and record it in the manifest
+    def commit(self):
+        with self.lock:
+            if self.file is None:
+                return None
+
+            self.file.close()
+            self.file = None
+
+            entry = {
+                "database": self.database,
+                "collection": self.collection_name,
+                "day": self.day.strftime("%Y-%m-%d"),
+                "file": os.path.relpath(self.path, self.directory),
+                "operation_id": self.operation_id,
+                "compression": self.compression,
+                "documents": self.documents,
+                "bytes": self.bytes,
+                "compressed_bytes": self.compressed_bytes,
+                "created": self.created.isoformat(),
+                "closed": datetime.utcnow().isoformat()
+            }
+
+        with manifest_lock:
+            with open(os.path.join(self.directory, MANIFEST_FILE), "a") as manifest:
+                manifest.write(json.dumps(entry) + "\n")
+                manifest.flush()
+                os.fsync(manifest.fileno())
+
+        return entry
+
+# Read back the documents of an archive file, used to restore or check an export
+def read_archive_file(path):
+    with open(path, "rb") as file:
+        data = file.read()
+
+    if path.endswith(FILE_EXTENSIONS["ZSTD"]):
+        import zstandard
+        # Every batch is a frame of its own
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True) as reader:
+            data = reader.read()
+    elif path.endswith(FILE_EXTENSIONS["GZIP"]):
+        data = gzip.decompress(data)
+
+    return bson.decode_all(data)
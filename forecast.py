@@ -0,0 +1,114 @@
+import time
+from logger import *
+from operationdb import get_automation_database
+from setting import get_variables
+
+# Expected runtime of one collection on the next run
+class RuntimeForecast:
+    def __init__(self, task_name, backlog_docs, forecast_seconds, docs_per_second, overhead_seconds, history_runs):
+        self.task_name = task_name
+        self.backlog_docs = backlog_docs
+        self.forecast_seconds = forecast_seconds
+        self.docs_per_second = docs_per_second
+        self.overhead_seconds = overhead_seconds
+        self.history_runs = history_runs
+
+    def __str__(self):
+        forecast = "unknown" if self.forecast_seconds is None else time.strftime("%H:%M:%S", time.gmtime(self.forecast_seconds))
+        return f"Collection: {self.task_name}, Backlog: {self.backlog_docs}, Forecast: {forecast}, Docs/s: {self.docs_per_second}, Overhead seconds: {self.overhead_seconds}, History runs: {self.history_runs}"
+
+# Forecast of the runtime of a collection from its completed runs and its current backlog
+#   seconds = overhead_seconds + backlog_docs / docs_per_second, fitted by least squares on the last FORECAST_HISTORY_RUNS runs
+class RuntimeForecaster(Logger):
+    def __init__(self, logfile, db=None):
+        super().__init__(logfile)
+        # Executor used to read the backlog, its planner cache and cutoff are handed to the executors that archive afterwards
+        self.db = db
+        self.history_runs = get_variables().FORECAST_HISTORY_RUNS
+
+    # Documents and seconds of the last completed runs of a collection, newest first
+    # Partial runs stopped by their time budget are left out, they would make the collection look faster
+    def read_history(self, task_name):
+        return get_automation_database(read_only=True).query("""SELECT docs_deleted, total_seconds FROM operation_details
+            WHERE task_name=? AND task_status='Completed' AND docs_deleted IS NOT NULL AND total_seconds>0
+            ORDER BY task_start_datetime DESC LIMIT ?""", (task_name, self.history_runs))
+
+    # Overhead seconds and seconds per document of the history
+    def fit(self, history):
+        docs_list = [docs for docs, seconds in history]
+        seconds_list = [seconds for docs, seconds in history]
+        mean_docs = sum(docs_list) / len(history)
+        mean_seconds = sum(seconds_list) / len(history)
+
+        variance = sum((docs - mean_docs) ** 2 for docs in docs_list)
+        if variance>0:
+            seconds_per_doc = sum((docs - mean_docs) * (seconds - mean_seconds) for docs, seconds in history) / variance
+            if seconds_per_doc>0:
+                overhead_seconds = max(0.0, mean_seconds - seconds_per_doc * mean_docs)
+                return overhead_seconds, seconds_per_doc
+
+        # One backlog size only, or a fit without meaning, the average throughput is used
+        if sum(docs_list)>0:
+            return 0.0, sum(seconds_list) / sum(docs_list)
+
+        return mean_seconds, 0.0
+
+    # Runtime of a collection for backlog_docs documents, the history average is used when the backlog is unknown
+    def forecast(self, task_name, backlog_docs=None):
+        try:
+            history = self.read_history(task_name=task_name)
+            if not history:
+                return RuntimeForecast(task_name=task_name, backlog_docs=backlog_docs, forecast_seconds=None, docs_per_second=None, overhead_seconds=None, history_runs=0)
+
+            overhead_seconds, seconds_per_doc = self.fit(history)
+            if (backlog_docs is None):
+                backlog_docs = int(sum(docs for docs, seconds in history) / len(history))
+
+            return RuntimeForecast(task_name=task_name,
+                                   backlog_docs=backlog_docs,
+                                   forecast_seconds=round(overhead_seconds + seconds_per_doc * backlog_docs, 1),
+                                   docs_per_second=round(1 / seconds_per_doc, 1) if seconds_per_doc>0 else None,
+                                   overhead_seconds=round(overhead_seconds, 1),
+                                   history_runs=len(history))
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    # Documents older than the retention cutoff, read as the archive run plans them
+    def read_backlog(self, task_name, ts_field_name):
+        try:
+            if (self.db is None):
+                return None
+
+            collection = self.db.get_database()[task_name]
+            index_name = self.db.create_index(collection_name=task_name, field_name=ts_field_name)
+            statistics = self.db.planner.get_range_statistics(collection=collection, ts_field_name=ts_field_name, cutoff_date=self.db.get_retention_cutoff(), index_name=index_name)
+            if (statistics is None):
+                return None
+
+            return statistics.count
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    # Forecast of every task, the backlog and the forecast are set on the tasks
+    def forecast_tasks(self, task_list):
+        forecast_list = []
+        for task in task_list:
+            backlog_docs = self.read_backlog(task_name=task.task_name, ts_field_name=task.ts_field_name)
+            forecast = self.forecast(task_name=task.task_name, backlog_docs=backlog_docs)
+            if (forecast is None):
+                continue
+
+            task.backlog_docs = backlog_docs
+            task.forecast_seconds = forecast.forecast_seconds
+            forecast_list.append(forecast)
+
+            print(f"Forecast: {forecast}")
+            self.log_info(f"Forecast: {forecast}")
+
+        return forecast_list
@@ -0,0 +1,55 @@
+from array import array
+from bson import ObjectId
+
+# Compact list of document ids, ObjectIds are kept as their 12 raw bytes
+class IdBuffer:
+    def __init__(self):
+        self.object_ids = bytearray()
+
+        # Ids of other types, with their position so that the order is kept
+        self.other_positions = array("q")
+        self.other_ids = []
+        self.count = 0
+
+    def append(self, value):
+        if isinstance(value, ObjectId):
+            self.object_ids.extend(value.binary)
+        else:
+            self.other_positions.append(self.count)
+            self.other_ids.append(value)
+        self.count = self.count + 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return self.count
+
+    # Ids in the order they were added
+    def __iter__(self):
+        object_id_offset = 0
+        other_index = 0
+        for position in range(self.count):
+            if other_index<len(self.other_positions) and self.other_positions[other_index]==position:
+                yield self.other_ids[other_index]
+                other_index = other_index + 1
+            else:
+                yield ObjectId(bytes(self.object_ids[object_id_offset:object_id_offset + 12]))
+                object_id_offset = object_id_offset + 12
+
+    # Ids in lists of at most chunk_size, for bounded $in deletes
+    def chunks(self, chunk_size):
+        chunk = []
+        for value in self:
+            chunk.append(value)
+            if len(chunk)>=chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    # Bytes held by the buffer, without the ids of other types
+    def size_in_bytes(self):
+        return len(self.object_ids) + self.other_positions.itemsize * len(self.other_positions)
@@ -0,0 +1,261 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bson.raw_bson import RawBSONDocument
+from setting import get_variables
+
+# Latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in pairs) + "}"
+
+# Metric with one value per label combination
+class Metric:
+    metric_type = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *label_values):
+        return MetricChild(self, tuple(label_values))
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        with self.lock:
+            lines.extend(self.samples())
+        return "\n".join(lines)
+
+# Metric bound to label values
+class MetricChild:
+    def __init__(self, metric, label_values):
+        self.metric = metric
+        self.label_values = label_values
+
+    def inc(self, amount=1):
+        self.metric.inc(self.label_values, amount)
+
+    def dec(self, amount=1):
+        self.metric.inc(self.label_values, -amount)
+
+    def set(self, value):
+        self.metric.set(self.label_values, value)
+
+    def observe(self, value):
+        self.metric.observe(self.label_values, value)
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get_value(self, label_values):
+        with self.lock:
+            return self.values.get(label_values, 0)
+
+    def samples(self):
+        return [f"{self.name}{format_labels(self.label_names, label_values)} {value}" for label_values, value in sorted(self.values.items())]
+
+class Gauge(Counter):
+    metric_type = "gauge"
+
+    def set(self, label_values, value):
+        with self.lock:
+            self.values[label_values] = value
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, label_values, value):
+        with self.lock:
+            bucket_counts, total, count = self.values.get(label_values) or ([0] * len(self.buckets), 0.0, 0)
+            bucket_no = bisect.bisect_left(self.buckets, value)
+            if bucket_no<len(self.buckets):
+                bucket_counts[bucket_no] = bucket_counts[bucket_no] + 1
+            self.values[label_values] = (bucket_counts, total + value, count + 1)
+
+    # Sum of the observed values
+    def get_sum(self, label_values):
+        with self.lock:
+            return self.values[label_values][1] if label_values in self.values else 0.0
+
+    def samples(self):
+        lines = []
+        for label_values, (bucket_counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative = cumulative + bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, label_values, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names, label_values, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {count}")
+        return lines
+
+# Metrics of the process
+class MetricsRegistry:
+    def __init__(self):
+        self.metric_list = []
+
+    def register(self, metric):
+        self.metric_list.append(metric)
+        return metric
+
+    # Prometheus text exposition format
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metric_list) + "\n"
+
+registry = MetricsRegistry()
+
+batch_read_seconds = registry.register(Histogram("archive_batch_read_seconds", "Time to read one batch from the source", ["collection"]))
+batch_write_seconds = registry.register(Histogram("archive_batch_write_seconds", "Time to write one batch into the archive", ["collection"]))
+batch_delete_seconds = registry.register(Histogram("archive_batch_delete_seconds", "Time to delete the ids of one batch from the source", ["collection"]))
+documents_copied = registry.register(Counter("archive_documents_copied_total", "Documents confirmed in the archive", ["collection"]))
+bytes_copied = registry.register(Counter("archive_bytes_copied_total", "BSON bytes confirmed in the archive, counted for raw BSON documents", ["collection"]))
+documents_deleted = registry.register(Counter("archive_documents_deleted_total", "Documents deleted from the source", ["collection"]))
+bytes_deleted = registry.register(Counter("archive_bytes_deleted_total", "BSON bytes deleted from the source, counted for raw BSON documents", ["collection"]))
+queue_depth = registry.register(Gauge("archive_queue_depth", "Batches waiting in a pipeline queue", ["collection", "queue"]))
+batches_in_flight = registry.register(Gauge("archive_batches_in_flight", "Batches read but not yet deleted", ["collection"]))
+
+# Volume and busy seconds of one collection during a task, the difference of its metrics since the task started
+# The seconds are summed over the batches, concurrent shards add up, so they are busy time rather than elapsed time
+class TaskMetrics:
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+        self.backlog_docs = None
+        self.plan_seconds = None
+        self.start_values = self.read_values()
+        for name in self.start_values:
+            setattr(self, name, None)
+
+    def read_values(self):
+        label_values = (self.collection_name,)
+        return {
+            "docs_copied": documents_copied.get_value(label_values),
+            "docs_deleted": documents_deleted.get_value(label_values),
+            "bytes_copied": bytes_copied.get_value(label_values),
+            "bytes_deleted": bytes_deleted.get_value(label_values),
+            "read_seconds": batch_read_seconds.get_sum(label_values),
+            "write_seconds": batch_write_seconds.get_sum(label_values),
+            "delete_seconds": batch_delete_seconds.get_sum(label_values)
+        }
+
+    # Take the differences, called once the task ended
+    def finish(self):
+        for name, value in self.read_values().items():
+            setattr(self, name, value - self.start_values[name])
+
+        # Documents moved without their bytes counted were not measured, NULL rather than a 0 taken for real data
+        if (self.docs_copied>0 and self.bytes_copied==0):
+            self.bytes_copied = None
+        if (self.docs_deleted>0 and self.bytes_deleted==0):
+            self.bytes_deleted = None
+        return self
+
+    def __str__(self):
+        return f"Collection: {self.collection_name}, Backlog: {self.backlog_docs}, Copied: {self.docs_copied}, Deleted: {self.docs_deleted}, Plan: {self.plan_seconds}, Read: {self.read_seconds}, Write: {self.write_seconds}, Delete: {self.delete_seconds}"
+
+# BSON bytes of a batch, decoded documents are not encoded again only to be measured, their bytes stay unset
+def get_batch_bytes(batch):
+    return sum(len(document.raw) for document in batch if isinstance(document, RawBSONDocument))
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes are not written into the console
+    def log_message(self, format, *args):
+        pass
+
+# Serve the metrics over HTTP or write them into a file while the job runs, METRICS_EXPORTER selects which
+class MetricsExporter:
+    def __init__(self):
+        self.exporter = get_variables().METRICS_EXPORTER
+        self.port = get_variables().METRICS_PORT
+        self.file_path = get_variables().METRICS_FILE
+        self.interval_seconds = get_variables().METRICS_INTERVAL_SECONDS
+        self.server = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        try:
+            if (self.exporter=="HTTP"):
+                self.server = ThreadingHTTPServer(("", self.port), MetricsHandler)
+                self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+                self.thread.start()
+                print(f"Metrics are served on port {self.port}")
+
+            elif (self.exporter=="FILE"):
+                self.thread = threading.Thread(target=self.write_periodically, name="metrics-file", daemon=True)
+                self.thread.start()
+                print(f"Metrics are written into {self.file_path}")
+
+            return True
+
+        except Exception as e:
+            print(f"Error: {e}")
+            return None
+
+    # Replace the file in one step, a collector never reads a half written file
+    def write_file(self):
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(registry.render())
+        os.replace(temp_path, self.file_path)
+
+    def write_periodically(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            try:
+                self.write_file()
+            except Exception as e:
+                print(f"Error: {e}")
+
+    def stop(self):
+        try:
+            self.stop_event.set()
+            if self.server is not None:
+                self.server.shutdown()
+                self.server.server_close()
+            if (self.exporter=="FILE"):
+                # Final values of the run
+                self.write_file()
+            if self.thread is not None:
+                self.thread.join(timeout=5)
+
+            return True
+
+        except Exception as e:
+            print(f"Error: {e}")
+            return None
@@ -0,0 +1,52 @@
+from pymongo import MongoClient
+import atexit
+import threading
+from setting import get_variables
+
+# One MongoClient per cluster for the whole process, every client keeps its own connection pool
+class MongoClientRegistry:
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    # Return the client registered under name, the first call creates it
+    def get_client(self, name, host, port, username, password, direct_connection=False):
+        with self.lock:
+            client = self.clients.get(name)
+            if client is None:
+                client = MongoClient(f"mongodb://{host}:{port}/", username=username, password=password, directConnection=direct_connection, **get_client_options())
+                self.clients[name] = client
+
+            return client
+
+    # Close every client and its pool
+    def close_all(self):
+        with self.lock:
+            for name, client in self.clients.items():
+                try:
+                    client.close()
+                except Exception as e:
+                    print(f"Exception: {str(e)}")
+            self.clients = {}
+
+client_registry = MongoClientRegistry()
+
+# Pool and timeout options shared by the sync and the async clients
+def get_client_options():
+    return {
+        "maxPoolSize": get_variables().MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": get_variables().MONGODB_MIN_POOL_SIZE,
+        "connectTimeoutMS": get_variables().MONGODB_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": get_variables().MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": get_variables().MONGODB_SOCKET_TIMEOUT_MS or None
+    }
+
+# Shared client of a cluster, direct_connection talks to one member of a replica set only
+def get_client(name, host, port, username, password, direct_connection=False):
+    return client_registry.get_client(name=name, host=host, port=port, username=username, password=password, direct_connection=direct_connection)
+
+# Close all shared clients, called once at the end of the run
+def close_clients():
+    client_registry.close_all()
+
+atexit.register(close_clients)
@@ -1,10 +1,15 @@
 from notification import notification
-from setting import get_variables
+from setting import get_variables, register_reload_signal
 from logger import Logger
 
 if __name__ == "__main__":
     try:
 
+        # Load and validate the settings once, SIGHUP reloads them
+        if get_variables() is None:
+            raise SystemExit("Invalid settings in cred/.env!")
+        register_reload_signal()
+
         # Nofication Log
         notification_log_file = get_variables().NOTIFICATION_LOG
 
@@ -1,9 +1,36 @@
+import atexit
 import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from setting import get_variables
 from logger import Logger
 
+# Remembers the fields assigned since the record was read or last saved
+class TrackedRecord:
+    def __setattr__(self, name, value):
+        dirty_fields = self.__dict__.setdefault("dirty_fields", set())
+        if name not in self.__dict__ or self.__dict__[name]!=value:
+            dirty_fields.add(name)
+        object.__setattr__(self, name, value)
+
+    # Changed fields and their values
+    def get_dirty_fields(self):
+        return {name: getattr(self, name) for name in sorted(self.__dict__.get("dirty_fields", set()))}
+
+    # Fields that were saved, a field assigned again in the meantime stays dirty
+    def mark_clean(self, saved_fields=None):
+        dirty_fields = self.__dict__.setdefault("dirty_fields", set())
+        if saved_fields is None:
+            dirty_fields.clear()
+            return
+
+        for name, value in saved_fields.items():
+            if getattr(self, name)==value:
+                dirty_fields.discard(name)
+
 # operation master class
-class OperationMaster:
+class OperationMaster(TrackedRecord):
     def __init__(self, operation_id, operation_log, start_datetime, end_datetime, total_duration, operation_status, source_database_ip, destination_database_ip, total_tasks, total_passed_tasks):
         self.operation_id =  operation_id
         self.operation_log = operation_log
@@ -15,11 +42,13 @@ class OperationMaster:
         self. destination_database_ip = destination_database_ip
         self.total_tasks = total_tasks
         self.total_passed_tasks = total_passed_tasks
-        
+        self.mark_clean()
 
 # operation detail class
-class OperationDetail:
-    def __init__(self, operation_id, task_id, task_name, task_description, task_start_datetime, task_end_datetime, task_duration, task_status, remarks, id_field_name, ts_field_name):
+class OperationDetail(TrackedRecord):
+    def __init__(self, operation_id, task_id, task_name, task_description, task_start_datetime, task_end_datetime, task_duration, task_status, remarks, id_field_name, ts_field_name, batch_size=None,
+                 backlog_docs=None, docs_copied=None, docs_deleted=None, bytes_copied=None, bytes_deleted=None,
+                 plan_seconds=None, read_seconds=None, write_seconds=None, delete_seconds=None, total_seconds=None, forecast_seconds=None):
         self.operation_id =  operation_id
         self.task_id=task_id
         self.task_name = task_name
@@ -31,10 +60,136 @@ class OperationDetail:
         self.remarks = remarks
         self.id_field_name = id_field_name
         self.ts_field_name = ts_field_name
+        self.batch_size = batch_size
+
+        # Numeric metrics of the task, and its runtime forecast made before it started
+        self.backlog_docs = backlog_docs
+        self.docs_copied = docs_copied
+        self.docs_deleted = docs_deleted
+        self.bytes_copied = bytes_copied
+        self.bytes_deleted = bytes_deleted
+        self.plan_seconds = plan_seconds
+        self.read_seconds = read_seconds
+        self.write_seconds = write_seconds
+        self.delete_seconds = delete_seconds
+        self.total_seconds = total_seconds
+        self.forecast_seconds = forecast_seconds
+        self.mark_clean()
+
+# One SQLite connection to automation.db, shared by every thread of the process
+class AutomationDatabase:
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+
+        # Autocommit, transactions are opened explicitly. The statement cache keeps the parameterized statements prepared
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False, cached_statements=256)
+        self.lock = threading.RLock()
+        self.transaction_depth = 0
+
+        # WAL lets the notification reader run while the archiver writes, NORMAL syncs at checkpoints only
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        if read_only:
+            self.connection.execute("PRAGMA query_only=ON")
+
+    # Run one statement, returns the number of changed rows
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).rowcount
+
+    def executemany(self, sql, parameter_list):
+        with self.lock:
+            return self.connection.executemany(sql, parameter_list).rowcount
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    # Statements of the block are committed together, nested blocks join the outer transaction
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            if self.transaction_depth==0:
+                self.connection.execute("BEGIN IMMEDIATE")
+            self.transaction_depth = self.transaction_depth + 1
+            try:
+                yield self
+            except Exception:
+                self.transaction_depth = self.transaction_depth - 1
+                if self.transaction_depth==0:
+                    self.connection.execute("ROLLBACK")
+                raise
+            else:
+                self.transaction_depth = self.transaction_depth - 1
+                if self.transaction_depth==0:
+                    self.connection.execute("COMMIT")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+# One writer and one reader connection per database file for the whole process
+class AutomationDatabaseRegistry:
+    def __init__(self):
+        self.databases = {}
+        self.lock = threading.Lock()
+
+    # Return the connection of path, the first call opens it
+    def get_database(self, path, read_only=False):
+        with self.lock:
+            database = self.databases.get((path, read_only))
+            if database is None:
+                database = AutomationDatabase(path=path, read_only=read_only)
+                self.databases[(path, read_only)] = database
+
+            return database
+
+    # Close every connection
+    def close_all(self):
+        with self.lock:
+            for database in self.databases.values():
+                try:
+                    database.close()
+                except Exception as e:
+                    print(f"Exception: {str(e)}")
+            self.databases = {}
+
+database_registry = AutomationDatabaseRegistry()
+
+# Shared connection of automation.db, read_only gives the connection of the readers
+def get_automation_database(read_only=False):
+    return database_registry.get_database(path=get_variables().AUTOMATION_DB, read_only=read_only)
+
+# Close the shared connections, called once at the end of the run
+def close_automation_databases():
+    database_registry.close_all()
+
+atexit.register(close_automation_databases)
+
+# Numeric columns of operation_details added after the first release, in table order
+TASK_METRIC_COLUMNS = {
+    "backlog_docs": "INTEGER",
+    "docs_copied": "INTEGER",
+    "docs_deleted": "INTEGER",
+    "bytes_copied": "INTEGER",
+    "bytes_deleted": "INTEGER",
+    "plan_seconds": "REAL",
+    "read_seconds": "REAL",
+    "write_seconds": "REAL",
+    "delete_seconds": "REAL",
+    "total_seconds": "REAL",
+    "forecast_seconds": "REAL"
+}
+
+# Text of a value as the former f-string statements stored it, the email template compares with 'None'
+def get_text(value):
+    return str(value)
 
 class OperationMasterData(Logger):
     def __init__(self, logfile, OperationMasterObj):
         super().__init__(logfile)
+        self.record = OperationMasterObj
         self.operation_id =  OperationMasterObj.operation_id
         self.operation_log = OperationMasterObj.operation_log
         self.start_datetime=OperationMasterObj.start_datetime
@@ -49,142 +204,64 @@ class OperationMasterData(Logger):
 
     def connect(self):
         try:
-            connection = sqlite3.connect(self.db)
-            connection.isolation_level = None
-
-            # print(f"Connected to {self.db}")
-
-            return connection  # Success
+            return get_automation_database()  # Success
         except Exception as e:
             print(f"Error: {e}")
             self.log_error(f"Exception: {str(e)}")
             return None  # Error
-             
+
     #@staticmethod
     def create(self):
         try:
-            cursor = self.connect().cursor()
-            sql = f"""INSERT INTO operation (operation_id, operation_log, start_datetime, end_datetime, total_duration, operation_status, source_database_ip, destination_database_ip, 
+            sql = """INSERT INTO operation (operation_id, operation_log, start_datetime, end_datetime, total_duration, operation_status, source_database_ip, destination_database_ip,
             total_tasks, total_passed_tasks)
-            VALUES ('{self.operation_id}', '{self.operation_log}', '{self.start_datetime}', '{self.end_datetime}', '{self.total_duration}', '{self.operation_status}', '{self.source_database_ip}', '{self.destination_database_ip}', '{self.total_tasks}', '{self.total_passed_tasks}');
-            """
-            #print(sql)
-            cursor.execute(sql)
-            self.connect().commit()
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+            self.connect().execute(sql, (get_text(self.operation_id), get_text(self.operation_log), get_text(self.start_datetime), get_text(self.end_datetime),
+                                         get_text(self.total_duration), get_text(self.operation_status), get_text(self.source_database_ip),
+                                         get_text(self.destination_database_ip), self.total_tasks, self.total_passed_tasks))
+            self.record.mark_clean()
 
             return True
         except Exception as e:
             print(f"Exception: {str(e)}")
             self.log_error(f"Exception: {str(e)}")
             return False
-    
+
     #@staticmethod
     def read_all(self):
         try:
-            cursor = self.connect().cursor()
-            cursor.execute("SELECT * FROM operation")
-            rows = cursor.fetchall()
+            rows = self.connect().query("SELECT * FROM operation")
             return [OperationMaster(*row) for row in rows]
         except Exception as e:
             print(f"Exception: {str(e)}")
             self.log_error(f"Exception: {str(e)}")
             return None
-    
+
     #@staticmethod
     def read_by_id(self, id):
         try:
-            sql = f"SELECT * FROM operation WHERE operation_id='{id}'"
-            cursor = self.connect().cursor()
-            cursor.execute(sql)
-            rows = cursor.fetchall()
+            rows = self.connect().query("SELECT * FROM operation WHERE operation_id=?", (id,))
             return [OperationMaster(*row) for row in rows]
         except Exception as e:
             print(f"Exception: {str(e)}")
             self.log_error(f"Exception: {str(e)}")
             return None
-        
+
     #@staticmethod
     def update(self):
         try:
-            if (id==None):
+            if (self.operation_id==None):
                 raise Exception("Please provide Id of the operation!")
-            
-            #print("START---")
-            sql_upd_col = "UPDATE operation SET "
-            sql_where = f" WHERE operation_id='{self.operation_id}';"
-            col_no = 0
-
-            if (self.operation_log!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" operation_log='{self.operation_log}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", operation_log='{self.operation_log}'"
-                col_no = col_no +1
-
-            if (self.start_datetime!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" start_datetime='{self.start_datetime}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", start_datetime='{self.start_datetime}'"
-                col_no = col_no +1
-            
-            if (self.end_datetime!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" end_datetime='{self.end_datetime}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", end_datetime='{self.end_datetime}'"
-                col_no = col_no +1
-
-            if (self.total_duration!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" total_duration='{self.total_duration}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", total_duration='{self.total_duration}'"
-                col_no = col_no +1
-
-            if (self.operation_status!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" operation_status='{self.operation_status}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", operation_status='{self.operation_status}'"
-                col_no = col_no +1
-
-            if (self.source_database_ip!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" source_database_ip='{self.source_database_ip}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", source_database_ip='{self.source_database_ip}'"
-                col_no = col_no +1
-
-            if (self.destination_database_ip!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" destination_database_ip='{self.destination_database_ip}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", destination_database_ip='{self.destination_database_ip}'"
-                col_no = col_no +1
-
-            if (self.total_tasks!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" total_tasks={self.total_tasks}"
-                else:
-                    sql_upd_col = sql_upd_col + f", total_tasks={self.total_tasks}"
-                col_no = col_no +1
-
-            if (self.total_passed_tasks!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" total_passed_tasks={self.total_passed_tasks}"
-                else:
-                    sql_upd_col = sql_upd_col + f", total_passed_tasks={self.total_passed_tasks}"
-                col_no = col_no +1
-
-            # concat
-            sql = sql_upd_col +" "+ sql_where
-            # print(sql)
-            # self.log_info(sql)
-
-            cursor = self.connect().cursor()
-            cursor.execute(sql)
-            self.connect().commit()
+
+            # Only the fields assigned since the last save, the statement text repeats and stays cached
+            columns = self.record.get_dirty_fields()
+            columns.pop("operation_id", None)
+            if not columns:
+                return True
+
+            sql = "UPDATE operation SET " + ", ".join(f"{name}=?" for name in columns) + " WHERE operation_id=?"
+            self.connect().execute(sql, list(columns.values()) + [self.operation_id])
+            self.record.mark_clean(columns)
 
             return True
         except Exception as e:
@@ -195,10 +272,7 @@ class OperationMasterData(Logger):
     #@staticmethod
     def delete(self, id):
         try:
-            sql = f"DELETE FROM operation WHERE operation_id = '{id}'"
-            cursor = self.connect().cursor()
-            cursor.execute(sql)
-            self.connect().commit()
+            self.connect().execute("DELETE FROM operation WHERE operation_id=?", (id,))
             return True
         except Exception as e:
             print(f"Exception: {str(e)}")
@@ -210,6 +284,7 @@ class OperationDetailData(Logger):
     def __init__(self, logfile, OperationDetailObj):
         super().__init__(logfile)
         self.db = get_variables().AUTOMATION_DB
+        self.record = OperationDetailObj
         self.operation_id =  OperationDetailObj.operation_id
         self.task_id=OperationDetailObj.task_id
         self.task_name = OperationDetailObj.task_name
@@ -221,148 +296,77 @@ class OperationDetailData(Logger):
         self.remarks = OperationDetailObj.remarks
         self.id_field_name = OperationDetailObj.id_field_name
         self.ts_field_name = OperationDetailObj.ts_field_name
+        self.batch_size = OperationDetailObj.batch_size
 
     def connect(self):
         try:
-            connection = sqlite3.connect(self.db)
+            return get_automation_database()  # Success
 
-            connection.isolation_level = None
-
-            return connection  # Success
-        
         except Exception as e:
             print(f"Error: {e}")
             self.log_error(f"Exception: {str(e)}")
             return None  # Error
-             
+
     #@staticmethod
     def create(self):
         try:
-            sql = f"""INSERT INTO operation_details (operation_id, task_id, task_name, task_description, task_start_datetime, task_end_datetime, task_duration, task_status, remarks, id_field_name, ts_field_name)
-              VALUES  ('{self.operation_id}', {self.task_id}, '{self.task_name}', '{self.task_description}', '{self.task_start_datetime}', '{self.task_end_datetime}', '{self.task_duration}', '{self.task_status}', '{self.remarks}', '{self.id_field_name}', '{self.ts_field_name}');
-"""
-            #print(sql)
-            cursor = self.connect().cursor()
-            cursor.execute(sql)
-            self.connect().commit()
+            sql = """INSERT INTO operation_details (operation_id, task_id, task_name, task_description, task_start_datetime, task_end_datetime, task_duration, task_status, remarks, id_field_name, ts_field_name, batch_size, """ + ", ".join(TASK_METRIC_COLUMNS) + """)
+              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?""" + ", ?" * len(TASK_METRIC_COLUMNS) + ")"
+            self.connect().execute(sql, (get_text(self.operation_id), self.task_id, get_text(self.task_name), get_text(self.task_description),
+                                         get_text(self.task_start_datetime), get_text(self.task_end_datetime), get_text(self.task_duration),
+                                         get_text(self.task_status), get_text(self.remarks), get_text(self.id_field_name), get_text(self.ts_field_name),
+                                         self.batch_size) + tuple(getattr(self.record, name) for name in TASK_METRIC_COLUMNS))
+            self.record.mark_clean()
 
             return True
         except Exception as e:
             print(f"Exception: {str(e)}")
             self.log_error(f"Exception: {str(e)}")
             return False
-    
+
     #@staticmethod
     def read_all(self):
         try:
-            cursor = self.connect().cursor()
-            cursor.execute("SELECT * FROM operation_details")
-            rows = cursor.fetchall()
+            rows = self.connect().query("SELECT * FROM operation_details")
             return [OperationDetail(*row) for row in rows]
         except Exception as e:
             print(f"Exception: {str(e)}")
             self.log_error(f"Exception: {str(e)}")
             return None
-    
+
     #@staticmethod
     def read_by_id(self, id):
         try:
-            cursor = self.connect().cursor()
-            cursor.execute(f"SELECT * FROM operation_details WHERE operation_id='{id}'")
-            rows = cursor.fetchall()
+            rows = self.connect().query("SELECT * FROM operation_details WHERE operation_id=?", (id,))
             return [OperationDetail(*row) for row in rows]
         except Exception as e:
             print(f"Exception: {str(e)}")
             self.log_error(f"Exception: {str(e)}")
             return None
-        
+
     #@staticmethod
-    def update(self):
+    # field_names limits the save to these fields, the other changes stay dirty for their own save
+    def update(self, field_names=None):
         try:
             if (self.operation_id==None):
                 raise Exception("Id should be empty!")
-            
-            sql_upd_col = "UPDATE operation_details SET "
-            sql_where = f" WHERE operation_id='{self.operation_id}' AND tasK_id='{self.task_id}';"
-            col_no = 0
-
-            if (self.task_id!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" task_id={self.task_id}"
-                else:
-                    sql_upd_col = sql_upd_col + f", task_id={self.task_id}"
-                col_no = col_no +1
-
-            if (self.task_name!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" task_name='{self.task_name}'"
-                else:
-                    sql_upd_col = sql_upd_col + f",  task_name='{self.task_name}'"
-                col_no = col_no +1
-
-            if (self.task_description!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" task_description='{self.task_description}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", task_description='{self.task_description}'"
-                col_no = col_no +1
-
-            if (self.task_start_datetime!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" task_start_datetime='{self.task_start_datetime}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", task_start_datetime='{self.task_start_datetime}'"
-                col_no = col_no +1
-
-            if (self.task_end_datetime!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" task_end_datetime='{self.task_end_datetime}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", task_end_datetime='{self.task_end_datetime}'"
-                col_no = col_no +1
-
-            if (self.task_duration!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" task_duration='{self.task_duration}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", task_duration='{self.task_duration}'"
-                col_no = col_no +1
-
-            if (self.task_status!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" task_status='{self.task_status}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", task_status='{self.task_status}'"
-                col_no = col_no +1
-
-            if (self.remarks!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" remarks='{self.remarks}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", remarks='{self.remarks}'"
-                col_no = col_no +1
-
-            if (self.id_field_name!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" id_field_name='{self.id_field_name}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", id_field_name='{self.id_field_name}'"
-                col_no = col_no +1
-
-            if (self.ts_field_name!=None):
-                if (col_no==0):
-                    sql_upd_col = sql_upd_col + f" ts_field_name='{self.ts_field_name}'"
-                else:
-                    sql_upd_col = sql_upd_col + f", ts_field_name='{self.ts_field_name}'"
-                col_no = col_no +1
-
-            # concat
-            sql = sql_upd_col +" "+ sql_where
-            #print(sql)
-            #self.log_info(sql)
-            
-            cursor = self.connect().cursor()
-            cursor.execute(sql)
+
+            # Only the fields assigned since the last save, the statement text repeats and stays cached
+            saved_fields = self.record.get_dirty_fields()
+            saved_fields.pop("operation_id", None)
+            saved_fields.pop("task_id", None)
+            if field_names is not None:
+                saved_fields = {name: value for name, value in saved_fields.items() if name in field_names}
+            if not saved_fields:
+                return True
+
+            columns = dict(saved_fields)
+            if columns.get("batch_size") is not None:
+                columns["batch_size"] = int(columns["batch_size"])
+
+            sql = "UPDATE operation_details SET " + ", ".join(f"{name}=?" for name in columns) + " WHERE operation_id=? AND task_id=?"
+            self.connect().execute(sql, list(columns.values()) + [self.operation_id, self.task_id])
+            self.record.mark_clean(saved_fields)
 
             return True
         except Exception as e:
@@ -373,42 +377,344 @@ class OperationDetailData(Logger):
     #@staticmethod
     def delete(self):
         try:
-            cursor = self.connect().cursor()
-            sql = f"DELETE FROM operation_details WHERE operation_id='{self.operation_id}' AND tasK_id='{self.task_id}';"
-            cursor.execute(sql)
-            self.connect().commit()
+            self.connect().execute("DELETE FROM operation_details WHERE operation_id=? AND task_id=?", (self.operation_id, self.task_id))
             return True
         except Exception as e:
             print(f"Exception: {str(e)}")
             self.log_error(f"Exception: {str(e)}")
             return None
 
-#Read Operation DB ******************************************************************************
-class read_operation_db:
-    def __init__(self, operation_id) -> None:
+# archive checkpoint class
+class ArchiveCheckpoint:
+    def __init__(self, collection_name, shard_no, shard_start, shard_end, last_archived_date, last_id, shard_status, operation_id, updated_datetime):
+        self.collection_name = collection_name
+        self.shard_no = shard_no
+        self.shard_start = shard_start
+        self.shard_end = shard_end
+        self.last_archived_date = last_archived_date
+        self.last_id = last_id
+        self.shard_status = shard_status
         self.operation_id = operation_id
+        self.updated_datetime = updated_datetime
+
+# Archive checkpoints, one row per collection shard
+class ArchiveCheckpointData(Logger):
+    def __init__(self, logfile):
+        super().__init__(logfile)
         self.db = get_variables().AUTOMATION_DB
+        self.create_table()
 
     def connect(self):
         try:
-            connection = sqlite3.connect(self.db)
-            connection.isolation_level = None
+            return get_automation_database()  # Success
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
 
-            print(f"Connected to {self.db}")
+    # Create the checkpoint table on databases created before it existed
+    def create_table(self):
+        try:
+            self.connect().execute("""CREATE TABLE IF NOT EXISTS archive_checkpoint(
+                collection_name VARCHAR(100) NOT NULL,
+                shard_no INTEGER NOT NULL,
+                shard_start text NOT NULL,
+                shard_end text NOT NULL,
+                last_archived_date text,
+                last_id text,
+                shard_status VARCHAR(20) NOT NULL,
+                operation_id VARCHAR(128),
+                updated_datetime text,
+                PRIMARY KEY (collection_name, shard_no)
+            )""")
+
+            return True
+        except Exception as e:
+            print(f"Exception: {str(e)}")
+            self.log_error(f"Exception: {str(e)}")
+            return None
 
-            return connection  # Success
+    # Read all shards of a collection
+    def read_by_collection(self, collection_name):
+        try:
+            rows = self.connect().query("SELECT * FROM archive_checkpoint WHERE collection_name=? ORDER BY shard_no", (collection_name,))
+            return [ArchiveCheckpoint(*row) for row in rows]
+        except Exception as e:
+            print(f"Exception: {str(e)}")
+            self.log_error(f"Exception: {str(e)}")
+            return None
+
+    # Replace the shard plan of a collection
+    def save_plan(self, collection_name, operation_id, shard_list):
+        try:
+            updated_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            with self.connect().transaction() as database:
+                database.execute("DELETE FROM archive_checkpoint WHERE collection_name=?", (collection_name,))
+                database.executemany("""INSERT INTO archive_checkpoint (collection_name, shard_no, shard_start, shard_end, last_archived_date, last_id, shard_status, operation_id, updated_datetime)
+                    VALUES (?, ?, ?, ?, ?, NULL, 'Pending', ?, ?)""",
+                    [(collection_name, shard.shard_no, shard.start_date.isoformat(), shard.end_date.isoformat(),
+                      shard.start_date.isoformat(), operation_id, updated_datetime) for shard in shard_list])
+
+            return True
+        except Exception as e:
+            print(f"Exception: {str(e)}")
+            self.log_error(f"Exception: {str(e)}")
+            return None
+
+    # Record that a shard is archived and deleted up to last_archived_date
+    def update_progress(self, collection_name, shard_no, last_archived_date, last_id, shard_status):
+        try:
+            updated_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            self.connect().execute("""UPDATE archive_checkpoint SET last_archived_date=?, last_id=COALESCE(?, last_id), shard_status=?, updated_datetime=?
+                WHERE collection_name=? AND shard_no=?""",
+                (last_archived_date.isoformat(), None if last_id is None else str(last_id), shard_status, updated_datetime, collection_name, shard_no))
+
+            return True
+        except Exception as e:
+            print(f"Exception: {str(e)}")
+            self.log_error(f"Exception: {str(e)}")
+            return None
+
+# Schema migrations of automation.db ******************************************************************
+# PRAGMA user_version holds the number of migrations applied, every migration is safe to run on a database that already has its change
+
+# batch_size of a task
+def migrate_batch_size(database):
+    columns = [row[1] for row in database.query("PRAGMA table_info(operation_details)")]
+    if "batch_size" not in columns:
+        database.execute("ALTER TABLE operation_details ADD COLUMN batch_size INTEGER")
+
+# Lookups of an operation and its tasks
+def migrate_operation_indexes(database):
+    database.execute("CREATE INDEX IF NOT EXISTS idx_operation_operation_id ON operation(operation_id)")
+    database.execute("CREATE INDEX IF NOT EXISTS idx_operation_details_operation_id ON operation_details(operation_id, task_id)")
+
+# Primary keys replace the operation_id indexes, SQLite adds them only by rebuilding the table
+def migrate_primary_keys(database):
+    database.execute("""CREATE TABLE operation_new(
+        operation_id VARCHAR(128) NOT NULL PRIMARY KEY,
+        operation_log text,
+        start_datetime text NOT NULL,
+        end_datetime text,
+        total_duration text,
+        operation_status VARCHAR(20) NOT NULL,
+        source_database_ip VARCHAR(128) NOT NULL,
+        destination_database_ip VARCHAR(20) NOT NULL,
+        total_tasks INTEGER NOT NULL,
+        total_passed_tasks INTEGER
+    )""")
+    # A duplicated operation_id keeps its last row
+    database.execute("""INSERT OR REPLACE INTO operation_new (operation_id, operation_log, start_datetime, end_datetime, total_duration, operation_status,
+        source_database_ip, destination_database_ip, total_tasks, total_passed_tasks)
+        SELECT operation_id, operation_log, start_datetime, end_datetime, total_duration, operation_status,
+        source_database_ip, destination_database_ip, total_tasks, total_passed_tasks FROM operation ORDER BY rowid""")
+    database.execute("DROP TABLE operation")
+    database.execute("ALTER TABLE operation_new RENAME TO operation")
+
+    database.execute("""CREATE TABLE operation_details_new(
+        operation_id VARCHAR(128) NOT NULL,
+        task_id INTEGER NOT NULL,
+        task_name VARCHAR(100) NOT NULL,
+        task_description text NOT NULL,
+        task_start_datetime text,
+        task_end_datetime text,
+        task_duration text,
+        task_status VARCHAR(20),
+        remarks text,
+        id_field_name text,
+        ts_field_name text,
+        batch_size INTEGER,
+        PRIMARY KEY (operation_id, task_id)
+    )""")
+    database.execute("""INSERT OR REPLACE INTO operation_details_new (operation_id, task_id, task_name, task_description, task_start_datetime, task_end_datetime,
+        task_duration, task_status, remarks, id_field_name, ts_field_name, batch_size)
+        SELECT operation_id, task_id, task_name, task_description, task_start_datetime, task_end_datetime,
+        task_duration, task_status, remarks, id_field_name, ts_field_name, batch_size FROM operation_details WHERE task_id IS NOT NULL ORDER BY rowid""")
+    database.execute("DROP TABLE operation_details")
+    database.execute("ALTER TABLE operation_details_new RENAME TO operation_details")
+
+    # Operations older than the retention are found by their start
+    database.execute("CREATE INDEX IF NOT EXISTS idx_operation_start_datetime ON operation(start_datetime)")
+
+# Daily summaries of the operations removed by the retention
+def migrate_daily_summary(database):
+    database.execute("""CREATE TABLE IF NOT EXISTS operation_daily_summary(
+        summary_date text NOT NULL PRIMARY KEY,
+        total_operations INTEGER NOT NULL,
+        completed_operations INTEGER NOT NULL,
+        total_tasks INTEGER NOT NULL,
+        total_passed_tasks INTEGER NOT NULL,
+        total_seconds INTEGER NOT NULL
+    )""")
+    database.execute("""CREATE TABLE IF NOT EXISTS task_daily_summary(
+        summary_date text NOT NULL,
+        task_name VARCHAR(100) NOT NULL,
+        total_runs INTEGER NOT NULL,
+        completed_runs INTEGER NOT NULL,
+        total_seconds INTEGER NOT NULL,
+        PRIMARY KEY (summary_date, task_name)
+    )""")
+
+# Numeric metrics of a task and the runtime forecast made before it started
+def migrate_task_metrics(database):
+    columns = [row[1] for row in database.query("PRAGMA table_info(operation_details)")]
+    for name, column_type in TASK_METRIC_COLUMNS.items():
+        if name not in columns:
+            database.execute(f"ALTER TABLE operation_details ADD COLUMN {name} {column_type}")
+
+    columns = [row[1] for row in database.query("PRAGMA table_info(task_daily_summary)")]
+    if "docs_deleted" not in columns:
+        database.execute("ALTER TABLE task_daily_summary ADD COLUMN docs_deleted INTEGER NOT NULL DEFAULT 0")
+
+SCHEMA_MIGRATIONS = [migrate_batch_size, migrate_operation_indexes, migrate_primary_keys, migrate_daily_summary, migrate_task_metrics]
+
+# Seconds of an HH:MM:SS duration, 0 when the task has none
+def get_duration_seconds(duration):
+    try:
+        hours, minutes, seconds = str(duration).split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        return 0
+
+# Schema migrations, retention of old operations and upkeep of the database file, run before an operation starts
+class AutomationDatabaseMaintenance(Logger):
+    def __init__(self, logfile):
+        super().__init__(logfile)
+        self.retention_days = get_variables().OPERATION_RETENTION_DAYS
+        self.vacuum_free_percent = get_variables().AUTOMATION_DB_VACUUM_FREE_PERCENT
+
+    def connect(self):
+        try:
+            return get_automation_database()  # Success
         except Exception as e:
             print(f"Error: {e}")
             self.log_error(f"Exception: {str(e)}")
             return None  # Error
-        
+
+    # Apply the migrations the database does not have yet, each one in its own transaction
+    def migrate(self):
+        database = self.connect()
+        version = database.query("PRAGMA user_version")[0][0]
+
+        for migration_no in range(version, len(SCHEMA_MIGRATIONS)):
+            with database.transaction():
+                SCHEMA_MIGRATIONS[migration_no](database)
+                database.execute(f"PRAGMA user_version = {migration_no + 1}")
+
+            print(f"Automation database migrated: {SCHEMA_MIGRATIONS[migration_no].__name__}")
+            self.log_info(f"Automation database migrated: {SCHEMA_MIGRATIONS[migration_no].__name__}")
+
+        return len(SCHEMA_MIGRATIONS)
+
+    # Fold operations started before the retention into daily summaries and remove their rows, 0 days keeps everything
+    def rollup_old_operations(self):
+        try:
+            if (self.retention_days==0):
+                return 0
+
+            cutoff_date = (datetime.now() - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+
+            with self.connect().transaction() as database:
+                operation_rows = database.query("""SELECT operation_id, substr(start_datetime, 1, 10), operation_status, total_tasks, total_passed_tasks, total_duration
+                    FROM operation WHERE start_datetime<?""", (cutoff_date,))
+                if not operation_rows:
+                    return 0
+
+                operation_summary = {}
+                for operation_id, summary_date, operation_status, total_tasks, total_passed_tasks, total_duration in operation_rows:
+                    summary = operation_summary.setdefault(summary_date, [0, 0, 0, 0, 0])
+                    summary[0] = summary[0] + 1
+                    summary[1] = summary[1] + (1 if operation_status=="Completed" else 0)
+                    summary[2] = summary[2] + (total_tasks or 0)
+                    summary[3] = summary[3] + (total_passed_tasks or 0)
+                    summary[4] = summary[4] + get_duration_seconds(total_duration)
+
+                task_rows = database.query("""SELECT substr(o.start_datetime, 1, 10), d.task_name, d.task_status, d.task_duration, d.total_seconds, d.docs_deleted
+                    FROM operation_details d JOIN operation o ON o.operation_id=d.operation_id WHERE o.start_datetime<?""", (cutoff_date,))
+
+                task_summary = {}
+                for summary_date, task_name, task_status, task_duration, total_seconds, docs_deleted in task_rows:
+                    summary = task_summary.setdefault((summary_date, task_name), [0, 0, 0, 0])
+                    summary[0] = summary[0] + 1
+                    summary[1] = summary[1] + (1 if task_status=="Completed" else 0)
+                    summary[2] = summary[2] + (int(total_seconds) if total_seconds is not None else get_duration_seconds(task_duration))
+                    summary[3] = summary[3] + (docs_deleted or 0)
+
+                database.executemany("""INSERT INTO operation_daily_summary (summary_date, total_operations, completed_operations, total_tasks, total_passed_tasks, total_seconds)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(summary_date) DO UPDATE SET total_operations=total_operations+excluded.total_operations,
+                    completed_operations=completed_operations+excluded.completed_operations, total_tasks=total_tasks+excluded.total_tasks,
+                    total_passed_tasks=total_passed_tasks+excluded.total_passed_tasks, total_seconds=total_seconds+excluded.total_seconds""",
+                    [(summary_date, *summary) for summary_date, summary in operation_summary.items()])
+
+                database.executemany("""INSERT INTO task_daily_summary (summary_date, task_name, total_runs, completed_runs, total_seconds, docs_deleted)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(summary_date, task_name) DO UPDATE SET total_runs=total_runs+excluded.total_runs,
+                    completed_runs=completed_runs+excluded.completed_runs, total_seconds=total_seconds+excluded.total_seconds,
+                    docs_deleted=docs_deleted+excluded.docs_deleted""",
+                    [(summary_date, task_name, *summary) for (summary_date, task_name), summary in task_summary.items()])
+
+                database.execute("DELETE FROM operation_details WHERE operation_id IN (SELECT operation_id FROM operation WHERE start_datetime<?)", (cutoff_date,))
+                database.execute("DELETE FROM operation WHERE start_datetime<?", (cutoff_date,))
+
+            print(f"Operations rolled up: {len(operation_rows)} started before {cutoff_date}")
+            self.log_info(f"Operations rolled up: {len(operation_rows)} started before {cutoff_date}")
+
+            return len(operation_rows)
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    # Refresh the planner statistics, rebuild the file when enough of it is free pages
+    def optimize(self):
+        try:
+            database = self.connect()
+            database.execute("PRAGMA optimize")
+
+            page_count = database.query("PRAGMA page_count")[0][0]
+            freelist_count = database.query("PRAGMA freelist_count")[0][0]
+            free_percent = (freelist_count * 100.0 / page_count) if page_count else 0
+
+            if (self.vacuum_free_percent>0 and free_percent>=self.vacuum_free_percent):
+                database.execute("VACUUM")
+                database.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                print(f"Automation database vacuumed: {freelist_count} of {page_count} pages were free")
+                self.log_info(f"Automation database vacuumed: {freelist_count} of {page_count} pages were free")
+
+            return True
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    def run(self):
+        self.migrate()
+        self.rollup_old_operations()
+        self.optimize()
+
+#Read Operation DB ******************************************************************************
+class read_operation_db:
+    def __init__(self, operation_id) -> None:
+        self.operation_id = operation_id
+        self.db = get_variables().AUTOMATION_DB
+
+    # Reader connection of its own, WAL serves it a snapshot while the archiver writes
+    def connect(self):
+        try:
+            return get_automation_database(read_only=True)  # Success
+        except Exception as e:
+            print(f"Error: {e}")
+            return None  # Error
+
     # Read operation master info
     def read_operation_master(self):
         try:
-            sql = f"SELECT * FROM operation WHERE operation_id='{self.operation_id}'"
-            cursor = self.connect().cursor()
-            cursor.execute(sql)
-            rows = cursor.fetchall()
+            rows = self.connect().query("SELECT * FROM operation WHERE operation_id=?", (self.operation_id,))
             return [OperationMaster(*row) for row in rows]
         except Exception as e:
             print(f"Exception: {str(e)}")
@@ -418,9 +724,7 @@ class read_operation_db:
     # read operation detail info
     def read_operation_detail(self):
         try:
-            cursor = self.connect().cursor()
-            cursor.execute(f"SELECT * FROM operation_details WHERE operation_id='{self.operation_id}'")
-            rows = cursor.fetchall()
+            rows = self.connect().query("SELECT * FROM operation_details WHERE operation_id=?", (self.operation_id,))
             return [OperationDetail(*row) for row in rows]
         except Exception as e:
             print(f"Exception: {str(e)}")
@@ -435,49 +739,61 @@ class operation_db:
         self.task_lst = task_lst
         self.operation_detail_lst = []
 
+    # Bring automation.db to the current schema, fold old operations into daily summaries and tidy the file
+    def upgrade_schema(self):
+        AutomationDatabaseMaintenance(logfile=self.operation_log).run()
+
     # Initialize operation database
     def setup_operation_database(self):
         try:
-            current_datetime = self.operation_master.start_datetime
-            
+            self.upgrade_schema()
+
             operation_id=self.operation_master.operation_id
-            #operation_obj = OperationMaster(operation_id=self.operation_id, operation_log=self.operation_log, self.start_datetime=current_datetime, end_datetime=None, total_duration=None, operation_status="In-Progress", source_database_vm_name=source_vm_name, source_database_vm_ip=source_database_vm_ip, total_tasks=total_tasks, total_passed_tasks=0, output_dump_file=None, output_data_disk_snapshot=None)
-            operation_master_data = OperationMasterData(logfile=self.operation_log, 
-                                                        OperationMasterObj=self.operation_master)
-            result= operation_master_data.create()
-            if (result==False):
-                raise Exception("Unable to save operational master information into database!")
-            
 
-            for task in self.task_lst:
-                operation_detail_obj = OperationDetail(operation_id=operation_id, 
-                                                       task_id=task.task_no, 
-                                                       task_name=task.task_name, 
-                                                       task_description=task.task_description, 
-                                                       task_start_datetime=None, 
-                                                       task_end_datetime=None, 
-                                                       task_duration=None, 
-                                                       task_status="Not Started", 
-                                                       remarks=None,
-                                                       id_field_name=task.id_field_name,
-                                                       ts_field_name = task.ts_field_name
-                                                       )
-                # Append into List
-                self.operation_detail_lst.append(operation_detail_obj)
-
-                operation_detail_data = OperationDetailData(logfile=self.operation_log, 
-                                                            OperationDetailObj=operation_detail_obj)
-                result= operation_detail_data.create()
-                if (result==False):
-                    raise Exception("Unable to save operational detail information into database!")
-            
+            # The operation and its tasks are inserted in one transaction
+            with get_automation_database().transaction():
+                self.create_operation(operation_id)
+
             return True
         except Exception as e:
             print(f"Exception: {str(e)}")
             return None
 
+    # Operation row and one row per task
+    def create_operation(self, operation_id):
+        #operation_obj = OperationMaster(operation_id=self.operation_id, operation_log=self.operation_log, self.start_datetime=current_datetime, end_datetime=None, total_duration=None, operation_status="In-Progress", source_database_vm_name=source_vm_name, source_database_vm_ip=source_database_vm_ip, total_tasks=total_tasks, total_passed_tasks=0, output_dump_file=None, output_data_disk_snapshot=None)
+        operation_master_data = OperationMasterData(logfile=self.operation_log, 
+                                                    OperationMasterObj=self.operation_master)
+        result= operation_master_data.create()
+        if (result==False):
+            raise Exception("Unable to save operational master information into database!")
+        
+
+        for task in self.task_lst:
+            operation_detail_obj = OperationDetail(operation_id=operation_id, 
+                                                   task_id=task.task_no, 
+                                                   task_name=task.task_name, 
+                                                   task_description=task.task_description, 
+                                                   task_start_datetime=None, 
+                                                   task_end_datetime=None, 
+                                                   task_duration=None, 
+                                                   task_status="Not Started", 
+                                                   remarks=None,
+                                                   id_field_name=task.id_field_name,
+                                                   ts_field_name = task.ts_field_name
+                                                   )
+            # Append into List
+            self.operation_detail_lst.append(operation_detail_obj)
+
+            operation_detail_data = OperationDetailData(logfile=self.operation_log, 
+                                                        OperationDetailObj=operation_detail_obj)
+            result= operation_detail_data.create()
+            if (result==False):
+                raise Exception("Unable to save operational detail information into database!")
+
     def update_operation_master(self):
         try:
+            # Collection workers share this instance, the shared connection serializes their writes
             operation_master_data = OperationMasterData(logfile=self.operation_log, 
                                                         OperationMasterObj=self.operation_master)
             status = operation_master_data.update()
@@ -487,13 +803,40 @@ class operation_db:
             print(f"Exception: {str(e)}")
             return None
     
-    def update_operation_detail(self, OperationDetail):
+    # Task and operation progress committed together, one transaction per report
+    def update_task_progress(self, OperationDetail):
+        try:
+            with get_automation_database().transaction():
+                if (self.update_operation_detail(OperationDetail=OperationDetail) is None):
+                    raise Exception("Unable to save operational detail information into database!")
+                if (self.update_operation_master() is None):
+                    raise Exception("Unable to save operational master information into database!")
+
+            return True
+        except Exception as e:
+            print(f"Exception: {str(e)}")
+            return None
+
+    # Several tasks in one transaction
+    def update_operation_details(self, task_list):
+        try:
+            with get_automation_database().transaction():
+                for task in task_list:
+                    if (self.update_operation_detail(OperationDetail=task) is None):
+                        raise Exception("Unable to save operational detail information into database!")
+
+            return True
+        except Exception as e:
+            print(f"Exception: {str(e)}")
+            return None
+
+    def update_operation_detail(self, OperationDetail, field_names=None):
         try:
             operation_detail_data = OperationDetailData(
                 logfile=self.operation_log,
                 OperationDetailObj=OperationDetail
             )
-            status = operation_detail_data.update()
+            status = operation_detail_data.update(field_names=field_names)
             
             return status
         except Exception as e:
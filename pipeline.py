@@ -0,0 +1,89 @@
+import queue
+import threading
+from logger import *
+import metrics
+
+# Reader thread drains the source batches into a bounded queue, writer threads take them from it
+class ArchivePipeline(Logger):
+    def __init__(self, logfile, queue_depth, writer_threads):
+        super().__init__(logfile)
+        self.queue_depth = max(1, queue_depth)
+        self.writer_threads = max(1, writer_threads)
+
+    # Call write_batch(chunk_no, batch) for every batch on the writer threads, return the results in chunk order
+    def run(self, batches, write_batch, collection_name):
+        # A full queue blocks the reader, memory stays at queue_depth x batch size
+        batch_queue = queue.Queue(maxsize=self.queue_depth)
+        # Shards of a collection and parallel collections share the gauge, each queue adds its own items
+        queue_depth = metrics.queue_depth.labels(collection_name, "pipeline")
+        stop_event = threading.Event()
+        results = {}
+        errors = []
+        lock = threading.Lock()
+
+        # Wait for free space in the queue unless a writer has failed
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    batch_queue.put(item, timeout=1)
+                    queue_depth.inc()
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def reader():
+            try:
+                chunk_no = 0
+                for batch in batches:
+                    chunk_no = chunk_no + 1
+                    if not put((chunk_no, batch)):
+                        break
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                stop_event.set()
+            finally:
+                # One end marker per writer
+                for writer_no in range(self.writer_threads):
+                    put(None)
+
+        def writer():
+            while True:
+                try:
+                    item = batch_queue.get(timeout=1)
+                    queue_depth.dec()
+                except queue.Empty:
+                    if stop_event.is_set():
+                        return
+                    continue
+
+                if item is None or stop_event.is_set():
+                    return
+
+                chunk_no, batch = item
+                try:
+                    result = write_batch(chunk_no, batch)
+                    with lock:
+                        results[chunk_no] = result
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    stop_event.set()
+                    return
+
+        threads = [threading.Thread(target=reader, name="archive-reader", daemon=True)]
+        threads.extend(threading.Thread(target=writer, name=f"archive-writer-{writer_no + 1}", daemon=True) for writer_no in range(self.writer_threads))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Items left behind by a failed run are no longer waiting
+        queue_depth.dec(batch_queue.qsize())
+
+        if errors:
+            raise errors[0]
+
+        return [results[chunk_no] for chunk_no in sorted(results)]
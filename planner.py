@@ -0,0 +1,130 @@
+import threading
+from pymongo import ASCENDING, DESCENDING
+from logger import *
+
+# Time range of a collection processed by one worker
+class TimeShard:
+    def __init__(self, shard_no, start_date, end_date, estimated_docs):
+        self.shard_no = shard_no
+        self.start_date = start_date
+        self.end_date = end_date
+        self.estimated_docs = estimated_docs
+
+    def __str__(self):
+        return f"Shard No: {self.shard_no}, Start: {self.start_date}, End: {self.end_date}, Estimated Docs: {self.estimated_docs}"
+
+# Expired documents of a collection
+class RangeStatistics:
+    def __init__(self, min_date, max_date, count):
+        self.min_date = min_date
+        self.max_date = max_date
+        self.count = count
+
+    def __str__(self):
+        return f"Min Date: {self.min_date}, Max Date: {self.max_date}, Count: {self.count}"
+
+class ArchivePlanner(Logger):
+    # Time slices counted per shard, more slices give evener shards
+    SLICES_PER_SHARD = 8
+
+    def __init__(self, logfile):
+        super().__init__(logfile)
+
+        # Statistics are computed once per run
+        self.statistics_cache = {}
+        self.lock = threading.Lock()
+
+    # Count documents in [from_date, to_date) from the timestamp index only
+    def count_range(self, collection, ts_field_name, from_date, to_date, index_name=None):
+        filter_criteria = {ts_field_name: {"$gte": from_date, "$lt": to_date}}
+        return self.count(collection=collection, filter_criteria=filter_criteria, index_name=index_name)
+
+    # The count command on an indexed range is answered by a COUNT_SCAN, no document is fetched
+    def count(self, collection, filter_criteria, index_name=None):
+        if index_name:
+            result = collection.database.command("count", collection.name, query=filter_criteria, hint=index_name)
+        else:
+            result = collection.database.command("count", collection.name, query=filter_criteria)
+
+        return int(result["n"])
+
+    # Min date, max date and count of the documents older than cutoff_date
+    def get_range_statistics(self, collection, ts_field_name, cutoff_date, index_name=None):
+        try:
+            cache_key = (collection.full_name, ts_field_name, cutoff_date)
+            with self.lock:
+                if cache_key in self.statistics_cache:
+                    return self.statistics_cache[cache_key]
+
+            filter_criteria = {ts_field_name: {"$lt": cutoff_date}}
+            projection = {ts_field_name: 1, "_id": 0}
+
+            # Both ends of the timestamp index, one key each
+            first_document = collection.find_one(filter_criteria, projection=projection, sort=[(ts_field_name, ASCENDING)])
+            last_document = collection.find_one(filter_criteria, projection=projection, sort=[(ts_field_name, DESCENDING)])
+
+            if first_document is None or last_document is None:
+                statistics = RangeStatistics(min_date=None, max_date=None, count=0)
+            else:
+                min_date = first_document[ts_field_name]
+                max_date = last_document[ts_field_name]
+                count = self.count_range(collection=collection, ts_field_name=ts_field_name, from_date=min_date, to_date=cutoff_date, index_name=index_name)
+                statistics = RangeStatistics(min_date=min_date, max_date=max_date, count=count)
+
+            print(f"Range statistics [{collection.name}]: {statistics}")
+            self.log_info(f"Range statistics [{collection.name}]: {statistics}")
+
+            with self.lock:
+                self.statistics_cache[cache_key] = statistics
+
+            return statistics
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
+
+    # Split [from_date, to_date) into shard_count ranges holding roughly the same number of documents
+    def get_time_shards(self, collection, ts_field_name, from_date, to_date, shard_count, index_name=None):
+        try:
+            if shard_count<=1:
+                return [TimeShard(shard_no=1, start_date=from_date, end_date=to_date, estimated_docs=None)]
+
+            # Count equal time slices, then merge neighbouring slices until a shard holds its share
+            slice_count = shard_count * self.SLICES_PER_SHARD
+            slice_width = (to_date - from_date) / slice_count
+
+            slice_list = []
+            for slice_no in range(slice_count):
+                slice_start = from_date + slice_width * slice_no
+                slice_end = to_date if slice_no==slice_count-1 else from_date + slice_width * (slice_no + 1)
+                slice_docs = self.count_range(collection=collection, ts_field_name=ts_field_name, from_date=slice_start, to_date=slice_end, index_name=index_name)
+                slice_list.append((slice_start, slice_end, slice_docs))
+
+            total_docs = sum(slice_docs for slice_start, slice_end, slice_docs in slice_list)
+            docs_per_shard = max(1, total_docs / shard_count)
+
+            shard_list = []
+            shard_start = from_date
+            shard_docs = 0
+            for slice_start, slice_end, slice_docs in slice_list:
+                shard_docs = shard_docs + slice_docs
+
+                if shard_docs>=docs_per_shard and len(shard_list)<shard_count-1:
+                    shard_list.append(TimeShard(shard_no=len(shard_list)+1, start_date=shard_start, end_date=slice_end, estimated_docs=shard_docs))
+                    shard_start = slice_end
+                    shard_docs = 0
+
+            if shard_start<to_date:
+                shard_list.append(TimeShard(shard_no=len(shard_list)+1, start_date=shard_start, end_date=to_date, estimated_docs=shard_docs))
+
+            for shard in shard_list:
+                print(shard)
+                self.log_info(str(shard))
+
+            return shard_list
+
+        except Exception as e:
+            print(f"Error: {e}")
+            self.log_error(f"Exception: {str(e)}")
+            return None  # Error
@@ -0,0 +1,86 @@
+import heapq
+import time
+from timeit import default_timer as timer
+from logger import *
+from setting import get_variables
+
+# Order of the collections in a run and the time they may use
+#   XML  keeps the order of the XML file
+#   LPT  longest forecast first, the usual greedy order to shorten the makespan on parallel workers
+#   SPT  shortest forecast first, the most collections are done early
+# A higher priority attribute in the XML file always goes first, the policy orders collections of the same priority
+class TaskScheduler(Logger):
+    def __init__(self, logfile, collection_list):
+        super().__init__(logfile)
+        self.policy = get_variables().SCHEDULE_POLICY
+        self.max_parallel_collections = max(1, get_variables().MAX_PARALLEL_COLLECTIONS)
+        self.window_seconds = get_variables().MAINTENANCE_WINDOW_MINUTES * 60
+
+        # Priority and time budget of every collection, by name
+        self.collections = {collection.task_name: collection for collection in collection_list}
+        self.window_end = None
+
+    # Expected seconds of a task, None when it has neither history nor a backlog to scale
+    def get_cost(self, task, docs_per_second):
+        if (task.forecast_seconds is not None):
+            return task.forecast_seconds
+        if (task.backlog_docs is not None and docs_per_second):
+            return task.backlog_docs / docs_per_second
+        return None
+
+    def get_priority(self, task):
+        collection = self.collections.get(task.task_name)
+        return collection.priority if collection is not None else 0
+
+    # Tasks in the order they should start, forecast_list gives the throughput of the collections with history
+    def order(self, task_list, forecast_list):
+        # Collections without history are scaled by the average throughput of the others
+        rates = [forecast.docs_per_second for forecast in forecast_list if forecast.docs_per_second]
+        docs_per_second = sum(rates) / len(rates) if rates else None
+
+        costs = {task.task_name: self.get_cost(task, docs_per_second) for task in task_list}
+
+        if (self.policy=="LPT"):
+            # An unknown cost may be large, it starts first
+            ordered_list = sorted(task_list, key=lambda task: (-self.get_priority(task), -(costs[task.task_name] if costs[task.task_name] is not None else float("inf"))))
+        elif (self.policy=="SPT"):
+            ordered_list = sorted(task_list, key=lambda task: (-self.get_priority(task), costs[task.task_name] if costs[task.task_name] is not None else float("inf")))
+        else:
+            ordered_list = sorted(task_list, key=lambda task: -self.get_priority(task))
+
+        makespan = self.get_makespan([costs[task.task_name] or 0 for task in ordered_list])
+        print(f"Schedule ({self.policy}): {', '.join(task.task_name for task in ordered_list)}")
+        print(f"Planned makespan: {time.strftime('%H:%M:%S', time.gmtime(makespan))} on {self.max_parallel_collections} workers")
+        self.log_info(f"Schedule ({self.policy}): {', '.join(task.task_name for task in ordered_list)}")
+        self.log_info(f"Planned makespan: {time.strftime('%H:%M:%S', time.gmtime(makespan))} on {self.max_parallel_collections} workers")
+
+        if (self.window_seconds>0 and makespan>self.window_seconds):
+            print(f"Planned makespan exceeds the maintenance window of {time.strftime('%H:%M:%S', time.gmtime(self.window_seconds))}")
+            self.log_warning(f"Planned makespan exceeds the maintenance window of {time.strftime('%H:%M:%S', time.gmtime(self.window_seconds))}")
+
+        return ordered_list
+
+    # End of the run when tasks start in this order on the workers, each one on the first worker free
+    def get_makespan(self, cost_list):
+        worker_ends = [0.0] * self.max_parallel_collections
+        for cost in cost_list:
+            heapq.heappush(worker_ends, heapq.heappop(worker_ends) + cost)
+        return max(worker_ends)
+
+    # The maintenance window starts with the run
+    def start(self):
+        if (self.window_seconds>0):
+            self.window_end = timer() + self.window_seconds
+
+    # No collection starts after the maintenance window
+    def is_window_closed(self):
+        return self.window_end is not None and timer()>=self.window_end
+
+    # Time a task may run from now, the earlier of its own budget and the end of the window, None without a limit
+    def get_deadline(self, task):
+        deadline = self.window_end
+        collection = self.collections.get(task.task_name)
+        if (collection is not None and collection.time_budget_minutes):
+            budget_end = timer() + collection.time_budget_minutes * 60
+            deadline = budget_end if deadline is None else min(deadline, budget_end)
+        return deadline
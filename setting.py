@@ -1,10 +1,20 @@
-from dotenv import load_dotenv
+from dotenv import load_dotenv, dotenv_values
 from pathlib import Path
 import os
 import platform
+import signal
+import threading
+
+# Variables without a default, the service cannot start without them
+REQUIRED_VARIABLES = ["MONGODB_HOST", "MONGODB_PORT", "MONGODB_DATABASE_NAME", "DATA_RETENTION_DAYS", "BATCH_SIZE",
+                      "INDEXES_XML_FILE_PATH", "LOG_DIRECTORY", "LOG_FILE", "PID_FILE", "AUTOMATION_DB",
+                      "EMAIL_TEMPLATE", "NOTIFICATION_LOG"]
+
+# Names set in the real environment before cred/.env is read, they win over cred/.env at startup and on reload
+ENVIRONMENT_NAMES = set(os.environ)
 
 class EnvVariables:
-    def __init__(self):
+    def __init__(self, reload=False):
 
         dotenv_path = None
         os_name = platform.system()
@@ -14,7 +24,17 @@ class EnvVariables:
         else:
             dotenv_path = Path('cred/.env')
 
-        load_dotenv(dotenv_path=dotenv_path)
+        if reload:
+            # load_dotenv keeps the values loaded first, the values of cred/.env are set again unless the real environment has them
+            for name, value in dotenv_values(dotenv_path=dotenv_path).items():
+                if (name not in ENVIRONMENT_NAMES and value is not None):
+                    os.environ[name] = value
+        else:
+            load_dotenv(dotenv_path=dotenv_path)
+
+        missing_variables = [name for name in REQUIRED_VARIABLES if not os.getenv(name)]
+        if missing_variables:
+            raise ValueError(f"Missing settings: {', '.join(missing_variables)}")
 
         self.MONGODB_HOST=os.getenv("MONGODB_HOST")
         self.MONGODB_PORT=os.getenv("MONGODB_PORT")
@@ -25,6 +45,57 @@ class EnvVariables:
         self.DATA_RETENTION_DAYS= int(os.getenv("DATA_RETENTION_DAYS"))
         self.BATCH_SIZE= int(os.getenv("BATCH_SIZE"))
         self.IS_ARCHIVE_ENABLED= os.getenv("IS_ARCHIVE_ENABLED")
+        self.ARCHIVE_WRITE_MODE= os.getenv("ARCHIVE_WRITE_MODE", "INSERT").upper()
+        self.ARCHIVE_ENGINE= os.getenv("ARCHIVE_ENGINE", "SYNC").upper()
+        self.PIPELINE_QUEUE_DEPTH= int(os.getenv("PIPELINE_QUEUE_DEPTH", "4"))
+        self.ARCHIVE_WRITER_THREADS= int(os.getenv("ARCHIVE_WRITER_THREADS", "0"))
+        self.ARCHIVE_RAW_BSON_ENABLED= os.getenv("ARCHIVE_RAW_BSON_ENABLED", "NO")
+
+        # Archive destination, a second MongoDB, compressed files on local disk or NULL to read without keeping or deleting anything
+        self.ARCHIVE_TARGET= os.getenv("ARCHIVE_TARGET", "MONGODB").upper()
+        self.ARCHIVE_FILE_COMPRESSION= os.getenv("ARCHIVE_FILE_COMPRESSION", "ZSTD").upper()
+        self.ARCHIVE_FILE_COMPRESSION_LEVEL= int(os.getenv("ARCHIVE_FILE_COMPRESSION_LEVEL", "3"))
+
+        # Documents sampled per collection by the dry run
+        self.DRY_RUN_SAMPLE_SIZE= int(os.getenv("DRY_RUN_SAMPLE_SIZE", "1000"))
+
+        # Compaction after the deletes, NONE, PRIMARY or ROLLING (secondaries first), only above both free space thresholds
+        self.COMPACT_MODE= os.getenv("COMPACT_MODE", "PRIMARY").upper()
+        self.COMPACT_MIN_FREE_MB= int(os.getenv("COMPACT_MIN_FREE_MB", "100"))
+        self.COMPACT_MIN_FREE_PERCENT= float(os.getenv("COMPACT_MIN_FREE_PERCENT", "10"))
+
+        # Operations older than OPERATION_RETENTION_DAYS are folded into daily summaries, 0 keeps them all
+        self.OPERATION_RETENTION_DAYS= int(os.getenv("OPERATION_RETENTION_DAYS", "90"))
+        self.AUTOMATION_DB_VACUUM_FREE_PERCENT= float(os.getenv("AUTOMATION_DB_VACUUM_FREE_PERCENT", "20"))
+
+        # Order of the collections, XML, LPT (longest forecast first) or SPT (shortest first), and the maintenance window of the run, 0 has no end
+        self.SCHEDULE_POLICY= os.getenv("SCHEDULE_POLICY", "XML").upper()
+        self.MAINTENANCE_WINDOW_MINUTES= int(os.getenv("MAINTENANCE_WINDOW_MINUTES", "0"))
+
+        # Completed runs of a collection used to forecast its runtime
+        self.FORECAST_HISTORY_RUNS= int(os.getenv("FORECAST_HISTORY_RUNS", "10"))
+
+        # Metrics of the running job, NONE, HTTP on METRICS_PORT or FILE rewritten every METRICS_INTERVAL_SECONDS
+        self.METRICS_EXPORTER= os.getenv("METRICS_EXPORTER", "NONE").upper()
+        self.METRICS_PORT= int(os.getenv("METRICS_PORT", "9108"))
+        self.METRICS_INTERVAL_SECONDS= int(os.getenv("METRICS_INTERVAL_SECONDS", "15"))
+
+        # Connection pool
+        self.MONGODB_MAX_POOL_SIZE= int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+        self.MONGODB_MIN_POOL_SIZE= int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+        self.MONGODB_CONNECT_TIMEOUT_MS= int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "20000"))
+        self.MONGODB_SERVER_SELECTION_TIMEOUT_MS= int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+        self.MONGODB_SOCKET_TIMEOUT_MS= int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "0"))
+        self.MAX_PARALLEL_COLLECTIONS= int(os.getenv("MAX_PARALLEL_COLLECTIONS", "1"))
+        self.ARCHIVE_SHARD_COUNT= int(os.getenv("ARCHIVE_SHARD_COUNT", "1"))
+        self.MAX_CONCURRENT_SHARDS= int(os.getenv("MAX_CONCURRENT_SHARDS", "1"))
+
+        self.ADAPTIVE_BATCH_ENABLED= os.getenv("ADAPTIVE_BATCH_ENABLED", "NO")
+        self.MIN_BATCH_SIZE= int(os.getenv("MIN_BATCH_SIZE", "500"))
+        self.MAX_BATCH_SIZE= int(os.getenv("MAX_BATCH_SIZE", "50000"))
+        self.TARGET_BATCH_LATENCY_MS= int(os.getenv("TARGET_BATCH_LATENCY_MS", "1000"))
+        self.MAX_REPLICATION_LAG_SECONDS= int(os.getenv("MAX_REPLICATION_LAG_SECONDS", "10"))
+        self.REPLICATION_LAG_CHECK_SECONDS= int(os.getenv("REPLICATION_LAG_CHECK_SECONDS", "5"))
 
         self.ARCHIVE_MONGODB_HOST=os.getenv("ARCHIVE_MONGODB_HOST")
         self.ARCHIVE_MONGODB_PORT=os.getenv("ARCHIVE_MONGODB_PORT")
@@ -38,12 +109,16 @@ class EnvVariables:
             self.LOG_FILE = os.getenv("LOG_FILE").replace("/", "\\")
             self.PID_FILE = os.getenv("PID_FILE").replace("/", "\\")
             self.AUTOMATION_DB = os.getenv("AUTOMATION_DB").replace("/", "\\")
+            self.ARCHIVE_FILE_DIRECTORY = os.getenv("ARCHIVE_FILE_DIRECTORY", "archive").replace("/", "\\")
+            self.METRICS_FILE = os.getenv("METRICS_FILE", "logs/metrics.prom").replace("/", "\\")
         else:
             self.INDEXES_XML_FILE_PATH = os.getenv("INDEXES_XML_FILE_PATH").replace("\\", "/")
             self.LOG_DIRECTORY = os.getenv("LOG_DIRECTORY").replace("\\", "/")
             self.LOG_FILE = os.getenv("LOG_FILE").replace("\\", "/")
             self.PID_FILE = os.getenv("PID_FILE").replace("\\", "/")
             self.AUTOMATION_DB = os.getenv("AUTOMATION_DB").replace("\\", "/")
+            self.ARCHIVE_FILE_DIRECTORY = os.getenv("ARCHIVE_FILE_DIRECTORY", "archive").replace("\\", "/")
+            self.METRICS_FILE = os.getenv("METRICS_FILE", "logs/metrics.prom").replace("\\", "/")
         
         # Notification
         self.SMTP_LOGIN_USERNAME = os.getenv("SMTP_LOGIN_USERNAME")
@@ -65,16 +140,104 @@ class EnvVariables:
             self.EMAIL_TEMPLATE = os.getenv("EMAIL_TEMPLATE").replace("\\", "/")
             self.NOTIFICATION_LOG = os.getenv("NOTIFICATION_LOG").replace("\\", "/")
         
+        self.validate()
+
+        # Settings are shared by every thread, they must not change after loading
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get("_frozen"):
+            raise AttributeError(f"Setting {name} is read-only, use reload_variables()")
+        super().__setattr__(name, value)
+
+    # Check the values that would otherwise fail in the middle of a run
+    def validate(self):
+        if self.DATA_RETENTION_DAYS<0:
+            raise ValueError("DATA_RETENTION_DAYS must not be negative")
+        if self.BATCH_SIZE<=0:
+            raise ValueError("BATCH_SIZE must be greater than 0")
+        if self.MIN_BATCH_SIZE>self.MAX_BATCH_SIZE:
+            raise ValueError("MIN_BATCH_SIZE must not be greater than MAX_BATCH_SIZE")
+        if self.MAX_PARALLEL_COLLECTIONS<=0 or self.ARCHIVE_SHARD_COUNT<=0 or self.MAX_CONCURRENT_SHARDS<=0:
+            raise ValueError("MAX_PARALLEL_COLLECTIONS, ARCHIVE_SHARD_COUNT and MAX_CONCURRENT_SHARDS must be greater than 0")
+        if self.ARCHIVE_WRITE_MODE not in ("INSERT", "UPSERT"):
+            raise ValueError("ARCHIVE_WRITE_MODE must be INSERT or UPSERT")
+        if self.ARCHIVE_ENGINE not in ("SYNC", "ASYNC"):
+            raise ValueError("ARCHIVE_ENGINE must be SYNC or ASYNC")
+        if self.ARCHIVE_WRITER_THREADS<0:
+            raise ValueError("ARCHIVE_WRITER_THREADS must not be negative")
+        if self.COMPACT_MODE not in ("NONE", "PRIMARY", "ROLLING"):
+            raise ValueError("COMPACT_MODE must be NONE, PRIMARY or ROLLING")
+        if self.METRICS_EXPORTER not in ("NONE", "HTTP", "FILE"):
+            raise ValueError("METRICS_EXPORTER must be NONE, HTTP or FILE")
+        if self.METRICS_INTERVAL_SECONDS<=0:
+            raise ValueError("METRICS_INTERVAL_SECONDS must be greater than 0")
+        if self.OPERATION_RETENTION_DAYS<0:
+            raise ValueError("OPERATION_RETENTION_DAYS must not be negative")
+        if self.AUTOMATION_DB_VACUUM_FREE_PERCENT<0:
+            raise ValueError("AUTOMATION_DB_VACUUM_FREE_PERCENT must not be negative")
+        if self.SCHEDULE_POLICY not in ("XML", "LPT", "SPT"):
+            raise ValueError("SCHEDULE_POLICY must be XML, LPT or SPT")
+        if self.MAINTENANCE_WINDOW_MINUTES<0:
+            raise ValueError("MAINTENANCE_WINDOW_MINUTES must not be negative")
+        if self.FORECAST_HISTORY_RUNS<=0:
+            raise ValueError("FORECAST_HISTORY_RUNS must be greater than 0")
+        if self.DRY_RUN_SAMPLE_SIZE<=0:
+            raise ValueError("DRY_RUN_SAMPLE_SIZE must be greater than 0")
+        if self.PIPELINE_QUEUE_DEPTH<=0:
+            raise ValueError("PIPELINE_QUEUE_DEPTH must be greater than 0")
+        if self.ARCHIVE_TARGET not in ("MONGODB", "FILE", "NULL"):
+            raise ValueError("ARCHIVE_TARGET must be MONGODB, FILE or NULL")
+        if self.ARCHIVE_FILE_COMPRESSION not in ("ZSTD", "GZIP", "NONE"):
+            raise ValueError("ARCHIVE_FILE_COMPRESSION must be ZSTD, GZIP or NONE")
+        if self.IS_ARCHIVE_ENABLED=="YES" and self.ARCHIVE_TARGET=="MONGODB" and not (self.ARCHIVE_MONGODB_HOST and self.ARCHIVE_MONGODB_PORT and self.ARCHIVE_MONGODB_DATABASE_NAME):
+            raise ValueError("ARCHIVE_MONGODB_HOST, ARCHIVE_MONGODB_PORT and ARCHIVE_MONGODB_DATABASE_NAME are required when IS_ARCHIVE_ENABLED is YES and ARCHIVE_TARGET is MONGODB")
+
+# Settings loaded once per process
+env_variables = None
+env_variables_lock = threading.Lock()
+
 def get_variables():
+    global env_variables
+
     try:
-        env_variable = EnvVariables()
+        if env_variables is None:
+            with env_variables_lock:
+                if env_variables is None:
+                    env_variables = EnvVariables()
 
-        return env_variable
+        return env_variables
     
     except Exception as e:
         print(f"Error: {e}")
 
+# Read cred/.env again, the current settings are kept if the new ones are invalid
+def reload_variables():
+    global env_variables
+
+    previous_environment = dict(os.environ)
+    try:
+        new_variables = EnvVariables(reload=True)
+
+        with env_variables_lock:
+            env_variables = new_variables
+
+        print("Settings are reloaded.")
+        return env_variables
+
+    except Exception as e:
+        # The environment of the current settings is put back
+        os.environ.clear()
+        os.environ.update(previous_environment)
+        print(f"Error: {e}")
+        print("Settings are not reloaded, the current settings are kept.")
+        return env_variables
+
+# Reload the settings on SIGHUP, must be called from the main thread
+def register_reload_signal():
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_variables())
+
 if __name__ == "__main__":
-    VARIABLES = EnvVariables()
-    print(f"MONGODB_HOST = {VARIABLES.MONGODB_HOST}")
-   
\ No newline at end of file
+    VARIABLES = get_variables()
+    print(f"MONGODB_HOST = {VARIABLES.MONGODB_HOST}")
\ No newline at end of file
@@ -1,11 +1,14 @@
 class Task:
-    def __init__(self, taskno, taskname, status, task_description, id_field_name, ts_field_name):
+    def __init__(self, taskno, taskname, status, task_description, id_field_name, ts_field_name, priority=0, time_budget_minutes=None):
         self.task_no = taskno
         self.task_name = taskname
         self.task_status = status
         self.task_description = task_description
         self.id_field_name = id_field_name
         self.ts_field_name = ts_field_name
+        # Higher priority starts first, the time budget stops the collection between days, it resumes on the next run
+        self.priority = priority
+        self.time_budget_minutes = time_budget_minutes
 
     def __str__(self):
-        return f"TaskNo: {self.task_no}, TaskName: {self.task_name}, Status: {self.task_status}, Description: {self.task_description}, id_field_name: {self.id_field_name}, ts_field_name: {self.ts_field_name} "
\ No newline at end of file
+        return f"TaskNo: {self.task_no}, TaskName: {self.task_name}, Status: {self.task_status}, Description: {self.task_description}, id_field_name: {self.id_field_name}, ts_field_name: {self.ts_field_name}, priority: {self.priority}, time_budget_minutes: {self.time_budget_minutes} "
\ No newline at end of file
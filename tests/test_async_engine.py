@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_engine import AsyncDatabaseExecutor
+from planner import TimeShard
+
+# Source collection of documents in memory, read through the Motor cursor calls the read stage uses
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for document in self.documents:
+            yield document
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, filter_condition, projection=None):
+        return FakeCursor(self.documents)
+
+    async def delete_many(self, filter_condition):
+        raise AssertionError("No document may be deleted when the archive write fails")
+
+# Archive sink failing on its second batch
+class FailingArchiveSink:
+    is_durable = True
+
+    def __init__(self):
+        self.batches = 0
+
+    async def write_async(self, batch):
+        self.batches = self.batches + 1
+        if self.batches>=2:
+            raise RuntimeError("archive write failed")
+        return batch, len(batch), 0
+
+    def commit(self):
+        return None
+
+class FailingSinkExecutor(AsyncDatabaseExecutor):
+    def __init__(self, logfile, collection):
+        super().__init__(logfile)
+        self.collection = collection
+
+    def get_async_clients(self):
+        return {self.database: {"events": self.collection}}, None
+
+    def create_async_archive_sink(self, state, day):
+        return FailingArchiveSink()
+
+class AsyncEngineTest(unittest.TestCase):
+    # A failing write stage fails the shard, the read stage must not wait on the full write queue
+    def test_failing_write_stage_fails_the_shard(self):
+        with tempfile.TemporaryDirectory() as work_directory:
+            executor = FailingSinkExecutor(os.path.join(work_directory, "test.log"), FakeCollection([{"_id": doc_no} for doc_no in range(10)]))
+            executor.is_archive_enabled = "YES"
+            executor.archive_target = "MONGODB"
+            executor.batch_size = 1
+            executor.pipeline_queue_depth = 2
+
+            start_date = datetime(2024, 1, 1)
+            shard = TimeShard(shard_no=1, start_date=start_date, end_date=start_date + timedelta(days=1), estimated_docs=10)
+            shard_run = executor.archive_time_range_async(collection_name="events", ts_field_name="ts", id_field_name="_id", shard=shard,
+                                                          total_docs=10, batch_controller=None, checkpoint_data=None)
+
+            with self.assertRaises(RuntimeError):
+                asyncio.run(asyncio.wait_for(shard_run, timeout=10))
+
+if __name__ == "__main__":
+    unittest.main()
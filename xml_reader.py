@@ -79,7 +79,10 @@ class XmlReader(Logger):
                 task_description = query.text.strip()
                 id_field_name = query.get("id_field_name")
                 ts_field_name = query.get("ts_field_name")
-                task = Task(taskno=task_no,taskname=task_name,status=task_status,task_description=task_description, id_field_name=id_field_name, ts_field_name=ts_field_name)
+                priority = int(query.get("priority", "0"))
+                time_budget_minutes = int(query.get("time_budget_minutes")) if query.get("time_budget_minutes") else None
+                task = Task(taskno=task_no,taskname=task_name,status=task_status,task_description=task_description, id_field_name=id_field_name, ts_field_name=ts_field_name,
+                            priority=priority, time_budget_minutes=time_budget_minutes)
                 task_list.extend([task])
                 #print (task)
   